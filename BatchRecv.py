@@ -0,0 +1,266 @@
+import socket
+import time
+from struct import pack, unpack
+from checksum import checksum, verify
+from MyIP import IPReceiver
+from Profiler import PROFILER
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None:
+    # An IPv4 header without options followed by a TCP header
+    HEADER_DTYPE = np.dtype([
+        ("ver_ihl", "u1"), ("tos", "u1"), ("total_length", ">u2"),
+        ("id", ">u2"), ("fragment", ">u2"), ("ttl", "u1"), ("protocol", "u1"),
+        ("ip_cksum", ">u2"), ("src", ">u4"), ("dst", ">u4"),
+        ("sport", ">u2"), ("dport", ">u2"), ("seq", ">u4"), ("ack", ">u4"),
+        ("offset", "u1"), ("control", "u1"), ("window", ">u2"),
+        ("tcp_cksum", ">u2"), ("urgent", ">u2"),
+    ])
+
+
+def fold(sums):
+    '''
+        Folds 32-bit or 64-bit one's complement sums into 16 bits
+        Parameters:
+            sums: an array of sums
+        Returns:
+            The folded sums
+    '''
+    for _ in range(3):
+        sums = (sums & 0xffff) + (sums >> 16)
+    return sums
+
+
+def decode_batch(buf, lengths, src: str, dst: str, ports=None):
+    '''
+        Decodes and verifies a batch of IP packets at once.
+        Row i of buf keeps a packet of lengths[i] bytes.
+
+        Parameters:
+            buf: a 2-D uint8 array
+            lengths: the lengths of the packets
+            src: the expected source IP
+            dst: the expected destination IP
+            ports: the expected (source port, destination port), or none for any
+        Returns:
+            headers: the IP and TCP header fields of every packet
+            valid: whether a packet is an unfragmented TCP segment from src to dst with correct checksums,
+                and between the expected ports
+            slow: whether a packet from src to dst has to be handled one by one,
+                because it is a fragment or has IP options
+    '''
+    n = len(lengths)
+    width = int(lengths.max()) if n else 0
+    width = max(width+(width & 1), 40)
+    headers = np.ndarray((n,), HEADER_DTYPE, buf, strides=(buf.shape[1],))
+
+    src = unpack("!I", socket.inet_aton(src))[0]
+    dst = unpack("!I", socket.inet_aton(dst))[0]
+    ours = ((headers["ver_ihl"] >> 4) == 4) & (headers["protocol"] == socket.IPPROTO_TCP) \
+        & (headers["src"] == src) & (headers["dst"] == dst) \
+        & (headers["total_length"] == lengths)
+    plain = (headers["ver_ihl"] & 0xf) == 5
+    fragment = (headers["fragment"] & 0x3fff) != 0
+    slow = ours & ~(plain & ~fragment)
+
+    # Bytes after the end of a packet may be left from an older packet, so they are zeroed
+    data = buf[:n, :width].astype(np.uint32)
+    data[np.arange(width)[None, :] >= lengths[:, None]] = 0
+    words = (data[:, 0::2] << 8) | data[:, 1::2]
+
+    ip_ok = fold(words[:, :10].sum(axis=1)) == 0xffff
+    pseudo = (lengths-20).astype(np.uint64) + np.uint64(
+        (src >> 16)+(src & 0xffff)+(dst >> 16)+(dst & 0xffff)+socket.IPPROTO_TCP)
+    tcp_ok = fold(words[:, 10:].sum(axis=1, dtype=np.uint64)+pseudo) == 0xffff
+    valid = ours & plain & ~fragment & ip_ok & tcp_ok & (lengths >= 40)
+    if ports is not None:
+        valid &= (headers["sport"] == ports[0]) & (headers["dport"] == ports[1])
+    return headers, valid, slow
+
+
+class BatchIPReceiver(IPReceiver):
+    '''
+        An IPReceiver that drains up to self.batch packets per wakeup into a 2-D buffer,
+        decodes their headers and verifies their checksums with NumPy at once.
+        Fragments and packets with IP options go through the original one-by-one path.
+        Only valid TCP segments of the connection given to self.start() are put into self.q,
+        so their TCP checksums are verified.
+    '''
+    verifies_tcp = True
+
+    def __init__(self, batch: int = 64, width: int = 65535) -> None:
+        '''
+            Parameters:
+                batch: the maximum number of packets handled at once
+                width: the maximum size of a packet, larger packets are truncated and dropped.
+                    The default fits any IP packet, including GRO-coalesced ones and jumbo frames
+        '''
+        if np is None:
+            raise ImportError("the batch receive path requires numpy")
+        super().__init__()
+        self.batch = batch
+        self.buf = np.zeros((batch, width), np.uint8)
+        self.rows = [memoryview(row) for row in self.buf]
+        self.lengths = np.zeros(batch, np.int64)
+        self.ports = None
+        self.truncated = 0
+
+    def start(self, expect_src: str, ports=None):
+        '''
+            Keeps the ports of the connection, segments of other connections are dropped in batches
+            Parameters:
+                expect_src: the IP of the peer
+                ports: (the port of the peer, my port)
+            Returns:
+                none
+        '''
+        self.ports = ports
+
+    def fill(self) -> int:
+        '''
+            Receives packets into self.buf until it is full or the socket has nothing to read
+            Parameters:
+                none
+            Returns:
+                The number of received packets
+        '''
+        n = 0
+        while n < self.batch:
+            try:
+                with PROFILER.span("ip.recv_into"):
+                    self.lengths[n] = self.sock.recv_into(self.rows[n])
+            except socket.timeout:
+                break
+            n += 1
+        return n
+
+    def slow_path(self, packet: bytes, expect_src: str):
+        '''
+            Handles a packet one by one, like IPReceiver.recv() does
+            Parameters:
+                packet: an IP packet
+                expect_src: as its name
+            Returns:
+                none
+        '''
+        res = self.ip_packet_split(packet)
+        if not res:
+            return
+        header, data = res
+        id, more, offset, protocol, src, dst = self.parse_ip_header(header)
+        count = len(self.q)
+        with PROFILER.span("ip.consume"):
+            self.consume(id, more, offset, data)
+        if len(self.q) > count and not self.verify_segment(self.q[-1], expect_src):
+            self.q.pop()
+
+    def recv(self, expect_src: str, timeout):
+        '''
+            Receives batches of packets for a while
+
+            Parameters:
+                expect_src: as its name
+                timeout: the maximum receiving time
+            Returns:
+                none
+        '''
+        start = time.time()
+        while time.time()-start < timeout:
+            n = self.fill()
+            if n == 0:
+                break
+            lengths = self.lengths[:n]
+            with PROFILER.span("ip.decode_batch"):
+                headers, valid, slow = decode_batch(
+                    self.buf, lengths, expect_src, self.ip, self.ports)
+            self.truncated += int((lengths >= self.buf.shape[1]).sum())
+            if (valid | slow).any():
+                if time.time()-self.last_recv > 180:
+                    print("Connection failed")
+                    exit()
+                self.last_recv = time.time()
+            for i in range(n):
+                if valid[i]:
+                    self.q.append(bytes(self.rows[i][20:lengths[i]]))
+                elif slow[i]:
+                    self.slow_path(bytes(self.rows[i][:lengths[i]]), expect_src)
+            if n < self.batch:
+                break
+
+    def stats(self) -> dict:
+        '''
+            Parameters:
+                none
+            Returns:
+                The counters of this receiver, including the packets dropped because they did not fit in a row
+        '''
+        return dict(super().stats(), truncated=self.truncated)
+
+
+def synthetic_packets(count: int, size: int = 1400):
+    '''
+        Builds valid IP packets carrying TCP segments, used by benchmark()
+        Parameters:
+            count: the number of packets
+            size: the size of the TCP payload
+        Returns:
+            A list of packets
+    '''
+    src, dst = socket.inet_aton("10.0.0.1"), socket.inet_aton("10.0.0.2")
+    packets = []
+    for i in range(count):
+        data = bytes((i+j) & 0xff for j in range(size))
+        tcp = pack("!HHIIBBHHH", 80, 5000, i*size, 1, 5 << 4, 0x10, 65535, 0, 0)
+        ph = pack("!4s4sBBH", src, dst, 0, socket.IPPROTO_TCP, len(tcp+data))
+        tcp = tcp[:16]+checksum(ph+tcp+data)+tcp[18:]
+        ip = pack("!BBHHHBBH4s4s", 0x45, 0, 20+len(tcp+data), i & 0xffff, 0, 64,
+                  socket.IPPROTO_TCP, 0, src, dst)
+        ip = ip[:10]+checksum(ip)+ip[12:]
+        packets.append(ip+tcp+data)
+    return packets
+
+
+def benchmark(sizes=(1, 8, 32, 128), total: int = 2048):
+    '''
+        Prints packets/s of the one-by-one path and of decode_batch() with several batch sizes
+        Parameters:
+            sizes: the batch sizes
+            total: the number of packets decoded for each measurement
+        Returns:
+            none
+    '''
+    packets = synthetic_packets(256)
+    src, dst = "10.0.0.1", "10.0.0.2"
+    ph = pack("!4s4sBBH", socket.inet_aton(src), socket.inet_aton(dst), 0,
+              socket.IPPROTO_TCP, len(packets[0])-20)
+    start = time.perf_counter()
+    for i in range(total):
+        packet = packets[i % len(packets)]
+        unpack("!LHHBBH4s4s", packet[:20])
+        unpack("!HHLLBBHHH", packet[20:40])
+        verify(packet[:20]) and verify(ph+packet[20:])
+    print(f"one by one: {total/(time.perf_counter()-start):.0f} packets/s")
+    if np is None:
+        print("numpy is not installed, the batch path is unavailable")
+        return
+    for size in sizes:
+        buf = np.zeros((size, 2048), np.uint8)
+        lengths = np.zeros(size, np.int64)
+        for i in range(size):
+            packet = packets[i % len(packets)]
+            buf[i, :len(packet)] = np.frombuffer(packet, np.uint8)
+            lengths[i] = len(packet)
+        start = time.perf_counter()
+        for _ in range(max(total//size, 1)):
+            _, valid, _ = decode_batch(buf, lengths, src, dst)
+        elapsed = time.perf_counter()-start
+        assert valid.all()
+        print(f"batch {size}: {max(total//size, 1)*size/elapsed:.0f} packets/s")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,424 @@
+#! /usr/bin/env python3
+import argparse
+import json
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import timeit
+from collections import deque
+from struct import pack
+from checksum import checksum, verify
+from MyChallenge import EtherSend
+from MyHttp import MyHttp
+from MyIP import IPReceiver, IPSender
+from MyTCP import TCP
+from SendBuffer import SendBuffer
+import BatchRecv
+
+'''
+    Micro-benchmarks of the hot functions of the stack. They need neither root nor network:
+    the objects are built with object.__new__() and only the attributes the functions read are set.
+
+    Each benchmark prints ops/s, and bytes/s if an op handles a payload.
+    --save writes the results to a baseline file, later runs compare with it and exit with 1
+    if any ops/s falls more than --threshold below the baseline.
+
+    The speed of a machine drifts, e.g. with its clock frequency or its neighbours on a VM. To keep the
+    figures stable, every round times each benchmark once, and the fastest round of each benchmark is kept,
+    so a slow moment spoils one round of every benchmark instead of all rounds of one.
+    A process also has a speed of its own, e.g. from its memory layout, so --runs times the benchmarks
+    in several processes and keeps the median of each benchmark.
+'''
+
+SRC, DST = "10.0.0.2", "10.0.0.1"
+BENCHMARKS = {}
+
+
+def benchmark(name: str, size: int = 0):
+    '''
+        Registers a benchmark
+        Parameters:
+            name: the name of the benchmark
+            size: the bytes handled by one op, 0 if bytes/s is meaningless
+        Returns:
+            A decorator for a function that prepares the fixtures and returns the op to time
+    '''
+    def register(setup):
+        BENCHMARKS[name] = (setup, size)
+        return setup
+    return register
+
+
+def ip_sender() -> IPSender:
+    '''
+        Returns:
+            An IPSender from SRC to DST, without sockets
+    '''
+    ips = object.__new__(IPSender)
+    ips.ip, ips.dst = SRC, DST
+    return ips
+
+
+def ip_receiver() -> IPReceiver:
+    '''
+        Returns:
+            An IPReceiver at SRC, without a socket
+    '''
+    receiver = object.__new__(IPReceiver)
+    receiver.ip = SRC
+    receiver.container = {}
+    receiver.q = deque()
+    return receiver
+
+
+def tcp() -> TCP:
+    '''
+        Returns:
+            A connected TCP from SRC to DST, without sockets
+    '''
+    t = object.__new__(TCP)
+    t.src_ip, t.dst_ip = SRC, DST
+    t.src_port, t.dst_port = 5000, 80
+    t.server_seq = t.server_ack = 1 << 20
+    t.receiver = ip_receiver()
+    return t
+
+
+def tcp_segment(t: TCP, size: int) -> bytes:
+    '''
+        Builds a segment from DST to SRC with a valid checksum
+        Parameters:
+            t: the TCP receiving it
+            size: the size of the payload
+        Returns:
+            The segment
+    '''
+    data = bytes(i & 0xff for i in range(size))
+    header = pack("!HHIIBBHHH", t.dst_port, t.src_port, t.server_seq, t.server_ack,
+                  5 << 4, 0x18, 65535, 0, 0)
+    ph = t.build_tcp_pseudo_header(len(header+data))
+    return header[:16]+checksum(ph+header+data)+header[18:]+data
+
+
+def fragments(size: int, shuffle: bool):
+    '''
+        Splits a datagram into fragments the way IPSender.send() does
+        Parameters:
+            size: the size of the datagram
+            shuffle: whether the fragments arrive out of order
+        Returns:
+            A list of (id, more, offset, data)
+    '''
+    mtu = 8*100
+    data = bytes(i & 0xff for i in range(size))
+    res = [(1, end < size, start//8, data[start:end])
+           for start, end in ((s, s+mtu) for s in range(0, size, mtu))]
+    if shuffle:
+        random.Random(0).shuffle(res)
+    return res
+
+
+@benchmark("checksum 1480B", 1480)
+def bench_checksum():
+    data = bytes(i & 0xff for i in range(1480))
+    return lambda: checksum(data)
+
+
+@benchmark("verify 1480B", 1480)
+def bench_verify():
+    t = tcp()
+    segment = tcp_segment(t, 1460)
+    data = t.build_tcp_pseudo_header(len(segment))+segment
+    return lambda: verify(data)
+
+
+@benchmark("build_ip_header")
+def bench_build_ip_header():
+    ips = ip_sender()
+    return lambda: ips.build_ip_header(1234, True, 800, 100, 0)
+
+
+@benchmark("build_tcp_header")
+def bench_build_tcp_header():
+    t = tcp()
+    control = (0, 1, 1, 0, 0, 0)
+    return lambda: t.build_tcp_header(3 << 31, 1 << 20, 5, control, 65535, 0)
+
+
+@benchmark("buildEtherFrame 1500B", 1500)
+def bench_build_ether_frame():
+    es = object.__new__(EtherSend)
+    es.mac = bytes(6)
+    dst = bytes.fromhex("ffffffffffff")
+    data = bytes(1500)
+    return lambda: es.buildEtherFrame(dst, data, EtherSend.IPV4)
+
+
+@benchmark("parse_ip_header")
+def bench_parse_ip_header():
+    receiver = ip_receiver()
+    header = ip_sender().build_ip_header(1234, True, 800, 100, 0)
+    return lambda: receiver.parse_ip_header(header)
+
+
+@benchmark("parse_tcp_packet 1460B", 1460)
+def bench_parse_tcp_packet():
+    t = tcp()
+    segment = tcp_segment(t, 1460)
+    return lambda: t.parse_tcp_packet(segment)
+
+
+def bench_consume(shuffle: bool):
+    receiver = ip_receiver()
+    parts = fragments(65000, shuffle)
+
+    def op():
+        for part in parts:
+            receiver.consume(*part)
+        receiver.q.clear()
+    return op
+
+
+@benchmark("consume 64KB in order", 65000)
+def bench_consume_in_order():
+    return bench_consume(False)
+
+
+@benchmark("consume 64KB shuffled", 65000)
+def bench_consume_shuffled():
+    return bench_consume(True)
+
+
+@benchmark("get_raw_number near")
+def bench_get_raw_number_near():
+    return lambda: TCP.get_raw_number(1000, 5000)
+
+
+@benchmark("get_raw_number 256 wraps")
+def bench_get_raw_number_far():
+    last = 256*TCP.mod+5000
+    return lambda: TCP.get_raw_number(1000, last)
+
+
+@benchmark("SendBuffer push+confirm 4096")
+def bench_send_buffer_push_confirm():
+    keys = range(1460, 1460*4097, 1460)
+
+    def op():
+        buf = SendBuffer()
+        for key in keys:
+            buf.push(key, None)
+        for key in keys:
+            buf.confirm(key)
+    return op
+
+
+@benchmark("SendBuffer get 4096")
+def bench_send_buffer_get():
+    buf = SendBuffer()
+    for key in range(1460, 1460*4097, 1460):
+        buf.push(key, None)
+    return buf.get
+
+
+@benchmark("SendBuffer first_after 4096")
+def bench_send_buffer_first_after():
+    buf = SendBuffer()
+    for key in range(1460, 1460*4097, 1460):
+        buf.push(key, None)
+    buf.confirm_upto(1460*2048)
+    return lambda: buf.first_after(1460*2048)
+
+
+@benchmark("decode_chunked 1MB", 1 << 20)
+def bench_decode_chunked():
+    http = MyHttp()
+    chunk = bytes(i & 0xff for i in range(4096))
+    piece = f"{len(chunk):x}\r\n".encode()+chunk+b"\r\n"
+    payload = piece*256+b"0\r\n\r\n"
+    return lambda: http.decode_chunked(payload)
+
+
+@benchmark("decode_batch 128x1480B", 128*1480)
+def bench_decode_batch():
+    np = BatchRecv.np
+    if np is None:
+        return None
+    packets = BatchRecv.synthetic_packets(128)
+    buf = np.zeros((128, 2048), np.uint8)
+    lengths = np.zeros(128, np.int64)
+    for i, packet in enumerate(packets):
+        buf[i, :len(packet)] = np.frombuffer(packet, np.uint8)
+        lengths[i] = len(packet)
+    return lambda: BatchRecv.decode_batch(buf, lengths, "10.0.0.1", "10.0.0.2")
+
+
+def calibrate(op, min_time: float) -> int:
+    '''
+        Parameters:
+            op: a function without arguments
+            min_time: the minimum duration of a round in seconds
+        Returns:
+            The number of calls that makes a round last at least min_time
+    '''
+    timer = timeit.Timer(op)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    return number
+
+
+def run(names, repeat: int, min_time: float) -> dict:
+    '''
+        Times the benchmarks with timeit, which disables the garbage collector
+        Parameters:
+            names: the names of the benchmarks to run
+            repeat: the number of rounds
+            min_time: the minimum duration of a round in seconds
+        Returns:
+            {name: {"ops_per_s": ..., "bytes_per_s": ...}} of the benchmarks that are available
+    '''
+    timers = {}
+    for name in names:
+        op = BENCHMARKS[name][0]()
+        if op is None:
+            continue
+        timers[name] = (timeit.Timer(op), calibrate(op, min_time))
+    best = {name: float("inf") for name in timers}
+    for _ in range(repeat):
+        for name, (timer, number) in timers.items():
+            best[name] = min(best[name], timer.timeit(number)/number)
+    results = {}
+    for name, seconds in best.items():
+        size = BENCHMARKS[name][1]
+        results[name] = {"ops_per_s": 1/seconds, "bytes_per_s": size/seconds if size else None}
+    return results
+
+
+def run_processes(names, runs: int, repeat: int, min_time: float) -> dict:
+    '''
+        Times the benchmarks in separate processes, one after another
+        Parameters:
+            names: the names of the benchmarks to run
+            runs: the number of processes
+            repeat: the number of rounds in each process
+            min_time: the minimum duration of a round in seconds
+        Returns:
+            The results like run(), with the median ops/s of each benchmark over the processes
+    '''
+    samples = {}
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, __file__, "--child", "--repeat", str(repeat),
+                                 "--min-time", str(min_time), "--", *names],
+                                stdout=subprocess.PIPE, check=True).stdout
+        for name, r in json.loads(output).items():
+            samples.setdefault(name, []).append(r["ops_per_s"])
+    results = {}
+    for name, ops in samples.items():
+        size = BENCHMARKS[name][1]
+        median = statistics.median(ops)
+        results[name] = {"ops_per_s": median, "bytes_per_s": size*median if size else None}
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    '''
+        Prints the results next to the baseline
+        Parameters:
+            results: returned by run()
+            baseline: results of an earlier run, may be empty
+            threshold: the tolerated drop of ops/s, between 0 and 1
+        Returns:
+            The names of the benchmarks that regressed
+    '''
+    regressed = []
+    print(f"{'benchmark':<32}{'ops/s':>14}{'MB/s':>10}{'baseline':>14}{'change':>9}")
+    for name, r in results.items():
+        mb = f"{r['bytes_per_s']/(1 << 20):.1f}" if r["bytes_per_s"] else "-"
+        line = f"{name:<32}{r['ops_per_s']:>14,.0f}{mb:>10}"
+        old = baseline.get(name)
+        if old is not None:
+            change = r["ops_per_s"]/old["ops_per_s"]-1
+            line += f"{old['ops_per_s']:>14,.0f}{change:>+9.1%}"
+            if change < -threshold:
+                regressed.append(name)
+                line += "  REGRESSED"
+        print(line)
+    return regressed
+
+
+def main() -> int:
+    '''
+        Parses the arguments, runs the benchmarks and compares them with the baseline
+        Returns:
+            The exit status: 1 if a benchmark regressed, otherwise 0
+    '''
+    parser = argparse.ArgumentParser(description="Micro-benchmarks of the hot functions of the stack")
+    parser.add_argument("names", nargs="*",
+                        help="run only the benchmarks whose name contains one of these words")
+    parser.add_argument("--baseline", default="benchmarks.json",
+                        help="the baseline file to compare with, or to write with --save")
+    parser.add_argument("--save", action="store_true",
+                        help="write the results to the baseline file instead of comparing")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fail if ops/s falls more than THRESHOLD (a fraction) below the baseline")
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="the number of rounds, the fastest is kept")
+    parser.add_argument("--min-time", type=float, default=0.1,
+                        help="the minimum duration of a round in seconds")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="the number of processes timing the benchmarks, the median is kept")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--list", action="store_true", help="list the benchmarks")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(BENCHMARKS))
+        return 0
+    names = [name for name in BENCHMARKS
+             if not args.names or any(word in name for word in args.names)]
+    if args.child:
+        # names are exact here, the parent selected them
+        print(json.dumps(run(args.names, args.repeat, args.min_time)))
+        return 0
+    results = run_processes(names, args.runs, args.repeat, args.min_time)
+    for name in names:
+        if name not in results:
+            print(f"{name:<32}skipped")
+    machine = {"python": platform.python_version(), "machine": platform.machine(),
+               "host": socket.gethostname()}
+
+    baseline = {}
+    if not args.save:
+        try:
+            with open(args.baseline) as f:
+                saved = json.load(f)
+            baseline = saved["results"]
+            if saved.get("machine") != machine:
+                print(f"Note: the baseline was recorded on {saved.get('machine')}")
+        except FileNotFoundError:
+            pass
+    regressed = compare(results, baseline, args.threshold)
+
+    if args.save:
+        saved = {"machine": machine, "results": results}
+        try:
+            # keep the baseline of the benchmarks that were not run this time
+            with open(args.baseline) as f:
+                saved["results"] = dict(json.load(f)["results"], **results)
+        except FileNotFoundError:
+            pass
+        with open(args.baseline, "w") as f:
+            json.dump(saved, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressed:
+        print(f"{len(regressed)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,243 @@
+import time
+from abc import ABC, abstractmethod
+
+
+class CongestionControl(ABC):
+    '''
+        The interface of a congestion control algorithm.
+        cwnd and ssthresh are counted in bytes.
+
+        TCP reports every new ACK, duplicate ACK and retransmission timeout,
+        and asks whether a segment can be sent with self.can_send().
+        on_ack() and on_dup_ack() return True when the first unACKed segment should be resent now.
+    '''
+    initial_window = 3
+
+    def __init__(self, mss: int = 1460) -> None:
+        '''
+            Parameters:
+                mss: the maximum segment size in bytes
+        '''
+        self.mss = mss
+        self.cwnd = self.initial_window*mss
+        self.ssthresh = 1 << 30
+
+    def can_send(self, inflight: int, size: int) -> bool:
+        '''
+            Parameters:
+                inflight: the number of sent but unACKed bytes
+                size: the size of the next segment
+            Returns:
+                Whether the segment fits in the congestion window.
+                A segment can always be sent if nothing is in flight.
+        '''
+        return inflight == 0 or inflight+size <= self.cwnd
+
+    @abstractmethod
+    def on_ack(self, ack: int, acked: int, inflight: int) -> bool:
+        '''
+            Called when an ACK acknowledges new data, to grow cwnd or to leave recovery
+            Parameters:
+                ack: the ACK number
+                acked: the number of newly ACKed bytes
+                inflight: the number of bytes still unACKed
+            Returns:
+                True if TCP should resend the first unACKed segment now, e.g. after a partial ACK
+                in fast recovery, otherwise False
+        '''
+
+    @abstractmethod
+    def on_dup_ack(self, inflight: int, snd_nxt: int) -> bool:
+        '''
+            Called when a duplicate ACK arrives. TCP does not count ACKs carrying data,
+            SYN or FIN, or a window update as duplicates
+            Parameters:
+                inflight: the number of sent but unACKed bytes
+                snd_nxt: the next sequence number to be sent
+            Returns:
+                True if TCP should resend the first unACKed segment now (fast retransmit), otherwise False
+        '''
+
+    @abstractmethod
+    def on_timeout(self, inflight: int):
+        '''
+            Called once per burst of retransmissions caused by an expired timer, before they are sent
+            Parameters:
+                inflight: the number of sent but unACKed bytes
+            Returns:
+                none
+        '''
+
+
+class NewReno(CongestionControl):
+    '''
+        Slow start, congestion avoidance, and fast retransmit/fast recovery as in RFC 5681 and RFC 6582.
+    '''
+    dup_threshold = 3
+
+    def __init__(self, mss: int = 1460) -> None:
+        '''
+            Parameters:
+                mss: the maximum segment size in bytes
+        '''
+        super().__init__(mss)
+        self.dup_acks = 0
+        self.in_recovery = False
+        self.recover = 0
+        self.acked_bytes = 0
+
+    def reduce(self, inflight: int) -> int:
+        '''
+            Parameters:
+                inflight: the number of sent but unACKed bytes when a loss is detected
+            Returns:
+                The new ssthresh
+        '''
+        return max(inflight//2, 2*self.mss)
+
+    def congestion_avoidance(self, acked: int):
+        '''
+            Grows cwnd by one MSS per cwnd of ACKed bytes
+            Parameters:
+                acked: the number of newly ACKed bytes
+            Returns:
+                none
+        '''
+        self.acked_bytes += acked
+        if self.acked_bytes >= self.cwnd:
+            self.acked_bytes -= self.cwnd
+            self.cwnd += self.mss
+
+    def on_ack(self, ack: int, acked: int, inflight: int) -> bool:
+        '''
+            Called when an ACK acknowledges new data
+            Parameters:
+                ack: the ACK number
+                acked: the number of newly ACKed bytes
+                inflight: the number of bytes still unACKed
+            Returns:
+                Whether the first unACKed segment should be resent (a partial ACK in fast recovery)
+        '''
+        self.dup_acks = 0
+        if self.in_recovery:
+            if ack >= self.recover:
+                self.in_recovery = False
+                self.cwnd = min(self.ssthresh, max(inflight, self.mss)+self.mss)
+                return False
+            self.cwnd = max(self.cwnd-acked, 0)
+            if acked >= self.mss:
+                self.cwnd += self.mss
+            return True
+        if self.cwnd < self.ssthresh:
+            self.cwnd += min(acked, self.mss)
+        else:
+            self.congestion_avoidance(acked)
+        return False
+
+    def on_dup_ack(self, inflight: int, snd_nxt: int) -> bool:
+        '''
+            Called when a duplicate ACK arrives
+            Parameters:
+                inflight: the number of sent but unACKed bytes
+                snd_nxt: the next sequence number to be sent
+            Returns:
+                Whether the first unACKed segment should be resent (fast retransmit)
+        '''
+        self.dup_acks += 1
+        if self.in_recovery:
+            self.cwnd += self.mss
+            return False
+        if self.dup_acks != self.dup_threshold:
+            return False
+        self.ssthresh = self.reduce(inflight)
+        self.cwnd = self.ssthresh+self.dup_threshold*self.mss
+        self.in_recovery = True
+        self.recover = snd_nxt
+        return True
+
+    def on_timeout(self, inflight: int):
+        '''
+            Called when a segment is resent because its timer expires
+            Parameters:
+                inflight: the number of sent but unACKed bytes
+            Returns:
+                none
+        '''
+        self.ssthresh = self.reduce(inflight)
+        self.cwnd = self.mss
+        self.dup_acks = 0
+        self.acked_bytes = 0
+        self.in_recovery = False
+
+
+class Cubic(NewReno):
+    '''
+        CUBIC as in RFC 9438, sharing fast retransmit/fast recovery with NewReno.
+        The window grows with a cubic function of the time since the last reduction,
+        and never slower than Reno would.
+    '''
+    C = 0.4
+    beta = 0.7
+
+    def __init__(self, mss: int = 1460) -> None:
+        '''
+            Parameters:
+                mss: the maximum segment size in bytes
+        '''
+        super().__init__(mss)
+        self.w_max = 0
+        self.epoch = None
+        # growth of less than one byte, carried over to the next ACK
+        self.remainder = 0.0
+
+    def reduce(self, inflight: int) -> int:
+        '''
+            Remembers the window at the loss as w_max and restarts the cubic epoch
+            Parameters:
+                inflight: the number of sent but unACKed bytes when a loss is detected
+            Returns:
+                The new ssthresh, beta times cwnd
+        '''
+        w = self.cwnd/self.mss
+        # fast convergence: release bandwidth to new flows if the window keeps shrinking
+        self.w_max = w*(1+self.beta)/2 if w < self.w_max else w
+        self.epoch = None
+        self.remainder = 0.0
+        return max(int(self.cwnd*self.beta), 2*self.mss)
+
+    def congestion_avoidance(self, acked: int):
+        '''
+            Grows cwnd towards the cubic target, and at least as fast as the Reno estimate w_est
+            Parameters:
+                acked: the number of newly ACKed bytes
+            Returns:
+                none
+        '''
+        now = time.monotonic()
+        w = self.cwnd/self.mss
+        if self.epoch is None:
+            self.epoch = now
+            self.w_est = w
+            if w < self.w_max:
+                self.k = ((self.w_max-w)/self.C) ** (1/3)
+                self.origin = self.w_max
+            else:
+                self.k = 0
+                self.origin = w
+        target = min(self.C*(now-self.epoch-self.k)**3+self.origin, 1.5*w)
+        self.w_est += 3*(1-self.beta)/(1+self.beta)*acked/self.cwnd
+        if target > w:
+            inc = (target-w)/w*acked
+        else:
+            inc = acked/(100*w)
+        # cwnd stays in whole bytes, the fraction of inc is kept for the next ACK
+        self.remainder += inc
+        grow = int(self.remainder)
+        self.remainder -= grow
+        self.cwnd = max(self.cwnd+grow, int(self.w_est*self.mss))
+
+
+ALGORITHMS = {
+    "newreno": NewReno,
+    "cubic": Cubic,
+}
@@ -0,0 +1,196 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import struct
+import time
+from MyChallenge import EtherSend
+from MyHttp import MyHttp
+from MyIP import IPReceiver, IPSender
+from MyTCP import TCP
+
+SOCKET_PATH = os.environ.get("RAWHTTPGET_SOCKET", "/tmp/rawhttpget.sock")
+
+
+class Stack():
+    '''
+        The warm part of the stack, shared by all jobs of a FetchDaemon:
+        1. one EtherSend, so the device, the routes and the MAC of the gateway are found only once
+        2. one IPReceiver and one IPSender, whose raw sockets stay open,
+           the destination of the IPSender is set for each job
+        3. per host, the resolved IP
+    '''
+
+    def __init__(self) -> None:
+        '''
+            Finds the gateway and opens the sockets
+        '''
+        self.es = EtherSend()
+        self.receiver = IPReceiver()
+        self.ips = None
+        self.hosts = {}
+
+    def tcp(self, host: str, port: int, tcp_args: dict) -> TCP:
+        '''
+            Builds a TCP on top of the warm resources
+            Parameters:
+                host: the host name in the URL
+                port: the port of the server
+                tcp_args: keyword arguments given to TCP
+            Returns:
+                A TCP ready for tcp_process()
+        '''
+        ip = self.hosts.get(host)
+        if ip is None:
+            ip = self.hosts[host] = socket.gethostbyname(host)
+        if self.ips is None:
+            self.ips = IPSender(ip, self.es)
+        self.ips.dst = ip
+        self.receiver.reset()
+        return TCP(ip, port, receiver=self.receiver, ips=self.ips, **tcp_args)
+
+
+class FetchDaemon():
+    '''
+        Keeps a Stack warm and runs download jobs sent by clients over a Unix domain socket.
+
+        A client sends one JSON line: {"url": ..., "cwd": ..., "tcp_args": {...}}
+        and receives JSON lines back: {"status": "started"}, then {"status": "log", "message": ...}
+        for each line the job printed, and finally {"status": "done", "bytes": ...} or
+        {"status": "error", "message": ...}.
+
+        Jobs run one at a time, since they share one receiver.
+        A client has self.timeout seconds to send its job, so a silent one cannot block the others.
+        The socket is only accessible by the user running the daemon,
+        and output files are given to the user of the client.
+    '''
+    timeout = 10
+
+    def __init__(self, path: str = SOCKET_PATH, cache=None) -> None:
+        '''
+            Parameters:
+                path: the path of the Unix domain socket
+                cache: a HttpCache shared by all jobs, or none
+        '''
+        self.path = path
+        self.cache = cache
+        self.stack = Stack()
+
+    def serve(self):
+        '''
+            Accepts and runs jobs until interrupted
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        os.chmod(self.path, 0o600)
+        server.listen()
+        print(f"rawhttpget daemon listening on {self.path}")
+        try:
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    try:
+                        self.handle(conn)
+                    except (OSError, ValueError) as e:
+                        print(f"Bad job: {e}")
+        finally:
+            server.close()
+            os.remove(self.path)
+
+    def handle(self, conn: socket.socket):
+        '''
+            Runs one job
+            Parameters:
+                conn: the connection to the client
+            Returns:
+                none
+        '''
+        conn.settimeout(self.timeout)
+        f = conn.makefile("rwb")
+        job = json.loads(f.readline())
+        if not isinstance(job, dict) or not isinstance(job.get("url"), str) \
+                or not isinstance(job.get("cwd", "."), str) or not isinstance(job.get("tcp_args", {}), dict):
+            raise ValueError("a job is a JSON object with a url")
+        conn.settimeout(None)
+        pid, uid, gid = struct.unpack("3i", conn.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+
+        def reply(message: dict):
+            f.write(json.dumps(message).encode()+b"\n")
+            f.flush()
+
+        reply({"status": "started"})
+        http = MyHttp(self.cache if job.get("cache", True) else None,
+                      job.get("tcp_args", {}), self.stack)
+        http.out_dir = job.get("cwd", ".")
+        log = io.StringIO()
+        start = time.time()
+        size, error = None, None
+        try:
+            with contextlib.redirect_stdout(log):
+                size = http.get(job["url"])
+        except SystemExit:
+            # the stack exits on fatal errors, which must not stop the daemon
+            error = "the connection failed"
+        except Exception as e:
+            error = repr(e)
+        for line in log.getvalue().splitlines():
+            reply({"status": "log", "message": line})
+        if os.geteuid() == 0 and http.output is not None and os.path.exists(http.output):
+            os.chown(http.output, uid, gid)
+        if error is not None:
+            reply({"status": "error", "message": error})
+        else:
+            reply({"status": "done", "bytes": size, "seconds": time.time()-start})
+
+
+def connect(path: str = SOCKET_PATH):
+    '''
+        Connects to a running daemon.
+        The socket lives in a shared directory, so the daemon has to run as root or as the current user,
+        otherwise another user could serve fake downloads.
+        Parameters:
+            path: the path of the Unix domain socket
+        Returns:
+            The connection, or none if no trusted daemon is running
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        pid, uid, gid = struct.unpack("3i", sock.getsockopt(
+            socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")))
+    except OSError:
+        sock.close()
+        return None
+    if uid not in (0, os.getuid()):
+        print(f"Ignoring the daemon on {path}: it runs as uid {uid}")
+        sock.close()
+        return None
+    return sock
+
+
+def submit(sock: socket.socket, job: dict):
+    '''
+        Sends a job to the daemon and yields its status messages until it finishes
+        Parameters:
+            sock: a connection returned by connect()
+            job: see FetchDaemon
+        Returns:
+            A generator of status messages
+    '''
+    with sock:
+        f = sock.makefile("rwb")
+        f.write(json.dumps(job).encode()+b"\n")
+        f.flush()
+        for line in f:
+            message = json.loads(line)
+            yield message
+            if message["status"] in ("done", "error"):
+                return
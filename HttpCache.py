@@ -0,0 +1,240 @@
+import hashlib
+import json
+import os
+import time
+
+
+class HttpCache():
+    '''
+        An on-disk cache of HTTP responses keyed by URL.
+
+        Each entry keeps the body in its own file and the validators (ETag, Last-Modified)
+        and freshness information (Cache-Control max-age) in an index file.
+        The total size of the bodies is limited, the least recently used entries are evicted first.
+
+        The index also keeps counters so that the hit rate and the saved bytes can be reported.
+    '''
+    INDEX = "index.json"
+
+    def __init__(self, root: str, limit: int = 256 << 20) -> None:
+        '''
+            Initializes the cache and loads its index from disk
+            Parameters:
+                root: the directory that keeps the cache
+                limit: the maximum total size of the cached bodies in bytes
+        '''
+        self.root = root
+        self.limit = limit
+        os.makedirs(self.root, exist_ok=True)
+        self.entries = {}
+        self.stats = {"hits": 0, "revalidated": 0,
+                      "misses": 0, "bytes_saved": 0}
+        try:
+            with open(os.path.join(self.root, self.INDEX)) as f:
+                index = json.load(f)
+            self.entries = index["entries"]
+            self.stats.update(index["stats"])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save_index(self):
+        '''
+            Writes the index to disk
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        path = os.path.join(self.root, self.INDEX)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"entries": self.entries, "stats": self.stats}, f)
+        os.replace(path + ".tmp", path)
+
+    def body_path(self, url: str) -> str:
+        '''
+            Parameters:
+                url: the URL of the resource
+            Returns:
+                The path of the file keeping the body of url
+        '''
+        name = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.root, name)
+
+    @staticmethod
+    def max_age(fields: dict):
+        '''
+            Parses Cache-Control of a response
+            Parameters:
+                fields: the header fields, keys are in lower case
+            Returns:
+                store: whether the response can be stored
+                max_age: seconds the response stays fresh, 0 if it must be revalidated
+        '''
+        store, age, no_cache = True, 0, False
+        for directive in fields.get("cache-control", "").split(","):
+            directive = directive.strip().lower()
+            if directive == "no-store":
+                store = False
+            elif directive == "no-cache":
+                no_cache = True
+            elif directive.startswith("max-age="):
+                try:
+                    age = max(int(directive[8:]), 0)
+                except ValueError:
+                    age = 0
+        if no_cache:
+            age = 0
+        return store, age
+
+    def lookup(self, url: str):
+        '''
+            Finds the entry of url and marks it as recently used
+            Parameters:
+                url: the URL of the resource
+            Returns:
+                The entry if url is cached, otherwise none
+        '''
+        entry = self.entries.get(url)
+        if entry is None:
+            return None
+        if not os.path.exists(self.body_path(url)):
+            self.entries.pop(url)
+            return None
+        entry["used"] = time.time()
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        '''
+            Parameters:
+                entry: an entry returned by self.lookup()
+            Returns:
+                Whether the entry can be served without asking the server
+        '''
+        return time.time()-entry["stored"] < entry["max_age"]
+
+    def validators(self, entry: dict) -> dict:
+        '''
+            Parameters:
+                entry: an entry returned by self.lookup()
+            Returns:
+                The header fields of a conditional request
+        '''
+        fields = {}
+        if entry.get("etag"):
+            fields["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            fields["If-Modified-Since"] = entry["last_modified"]
+        return fields
+
+    def load(self, url: str) -> bytes:
+        '''
+            Parameters:
+                url: the URL of the resource
+            Returns:
+                The cached body of url
+        '''
+        with open(self.body_path(url), "rb") as f:
+            return f.read()
+
+    def store(self, url: str, fields: dict, body: bytes):
+        '''
+            Stores a 200 response, and evicts old entries if the cache is too large
+            Parameters:
+                url: the URL of the resource
+                fields: the header fields, keys are in lower case
+                body: the decoded body
+            Returns:
+                none
+        '''
+        store, age = self.max_age(fields)
+        if not store or len(body) > self.limit:
+            self.remove(url)
+            return
+        with open(self.body_path(url), "wb") as f:
+            f.write(body)
+        now = time.time()
+        self.entries[url] = {
+            "etag": fields.get("etag"),
+            "last_modified": fields.get("last-modified"),
+            "max_age": age,
+            "stored": now,
+            "used": now,
+            "size": len(body),
+        }
+        self.evict()
+        self.save_index()
+
+    def refresh(self, url: str, fields: dict):
+        '''
+            Updates an entry after the server answered 304 Not Modified
+            Parameters:
+                url: the URL of the resource
+                fields: the header fields of the 304 response, keys are in lower case
+            Returns:
+                none
+        '''
+        entry = self.entries[url]
+        # a 304 without Cache-Control keeps the freshness lifetime of the stored response
+        if "cache-control" in fields:
+            _, entry["max_age"] = self.max_age(fields)
+        entry["stored"] = time.time()
+        if fields.get("etag"):
+            entry["etag"] = fields["etag"]
+        if fields.get("last-modified"):
+            entry["last_modified"] = fields["last-modified"]
+
+    def remove(self, url: str):
+        '''
+            Removes the entry of url
+            Parameters:
+                url: the URL of the resource
+            Returns:
+                none
+        '''
+        self.entries.pop(url, None)
+        try:
+            os.remove(self.body_path(url))
+        except OSError:
+            pass
+
+    def evict(self):
+        '''
+            Removes the least recently used entries until the cache fits in self.limit
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        total = sum(entry["size"] for entry in self.entries.values())
+        for url, entry in sorted(self.entries.items(), key=lambda item: item[1]["used"]):
+            if total <= self.limit:
+                break
+            total -= entry["size"]
+            self.remove(url)
+
+    def record(self, result: str, size: int = 0):
+        '''
+            Counts a lookup result and persists the index
+            Parameters:
+                result: "hits", "revalidated" or "misses"
+                size: the number of body bytes that were not downloaded
+            Returns:
+                none
+        '''
+        self.stats[result] += 1
+        self.stats["bytes_saved"] += size
+        self.save_index()
+
+    def report(self) -> str:
+        '''
+            Parameters:
+                none
+            Returns:
+                A line describing the hit rate and the saved bytes
+        '''
+        hits = self.stats["hits"]+self.stats["revalidated"]
+        total = hits+self.stats["misses"]
+        rate = hits/total*100 if total else 0
+        return (f"cache: {hits}/{total} hits ({rate:.1f}%), "
+                f"{self.stats['revalidated']} revalidated, "
+                f"{self.stats['bytes_saved']/1024:.1f}KB saved")
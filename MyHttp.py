@@ -1,20 +1,41 @@
 #! /usr/bin/env python3
 from urllib.parse import urlparse
 from MyTCP import TCP
+import os
+from SendStream import SendStream, FileBody, IterBody
+from Profiler import PROFILER
 import socket
 
 
 class MyHttp():
     '''
         Send a GET message, format the response, and save it.
+        If a HttpCache is given, responses are cached and revalidated with conditional requests.
+        Also uploads files or iterators of bytes with PUT and POST.
     '''
     NEWLINE = "\r\n"
 
-    def build_get_message(self) -> str:
+    def __init__(self, cache=None, tcp_args: dict = None, stack=None) -> None:
         '''
-            Build a GET message.
             Parameters:
-                none
+                cache: a HttpCache, or none to always download
+                tcp_args: keyword arguments given to TCP
+                stack: a FetchDaemon.Stack to reuse its warm sockets, or none to open new ones
+        '''
+        self.cache = cache
+        self.tcp_args = tcp_args or {}
+        self.stack = stack
+        self.out_dir = "."
+        self.output = None
+        self.recv_stats = {}
+        self.tcp_stats = {}
+
+    def build_message(self, method: str, extra: dict = None) -> str:
+        '''
+            Build the header of a request.
+            Parameters:
+                method: GET, PUT or POST
+                extra: additional header fields, which override the default ones
             Returns:
                 The message with str type
         '''
@@ -22,25 +43,85 @@ class MyHttp():
         header_dict["Host"] = self.pr.netloc
         header_dict["connection"] = "keep-alive"
         header_dict["content-length"] = "0"
+        if extra:
+            header_dict.update(extra)
+        if "transfer-encoding" in header_dict:
+            header_dict.pop("content-length")
         header = self.NEWLINE.join(
             map(lambda item: f"{item[0]}: {item[1]}", header_dict.items()))
-        return f"GET {self.pr.path} HTTP/1.1{self.NEWLINE}{header}{self.NEWLINE*2}"
+        return f"{method} {self.pr.path} HTTP/1.1{self.NEWLINE}{header}{self.NEWLINE*2}"
 
-    def get(self, url: str) -> int:
+    def build_get_message(self, extra: dict = None) -> str:
         '''
-            Download a resource with a URL.
+            Build a GET message.
             Parameters:
-                url: the URL of the resource
+                extra: additional header fields, such as the validators of a conditional request
             Returns:
-                The number of bytes written to the output file.
-                If an invalid message is received, returns -1 and does not create any file
+                The message with str type
         '''
-        self.pr = urlparse(url)
-        ip = socket.gethostbyname(self.pr.netloc)
-        path = self.pr.path
-        message = self.build_get_message()
-        tcp = TCP(ip, 80)
-        res = tcp.tcp_process(message.encode())
+        return self.build_message("GET", extra)
+
+    def parse_header(self, header: str):
+        '''
+            Parse the header of a response.
+            Parameters:
+                header: the header without the empty line
+            Returns:
+                status: the status code, -1 if the status line is invalid
+                fields: the header fields, keys are in lower case
+        '''
+        lines = header.split(self.NEWLINE)
+        parts = lines[0].split(" ")
+        status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else -1
+        fields = {}
+        for line in lines[1:]:
+            p = line.find(":")
+            if p != -1:
+                fields[line[:p].strip().lower()] = line[p+1:].strip()
+        return status, fields
+
+    def decode_chunked(self, payload: bytes):
+        '''
+            Decode a body with the chunked transfer coding.
+            Parameters:
+                payload: the body
+            Returns:
+                The decoded body, or none if the format is bad
+        '''
+        CRLF = self.NEWLINE.encode()
+        lst = payload.split(CRLF)
+        tmp = b""
+        for i in range(0, len(lst), 2):
+            length = int(lst[i].decode(), 16)
+            if length == 0:
+                break
+            if length != len(lst[i+1]):
+                return None
+            tmp += lst[i+1]
+        return tmp
+
+    def request(self, message: bytes, body=None):
+        '''
+            Send a request and split the response.
+            Parameters:
+                message: the header of the request
+                body: none, or a FileBody/IterBody sent after the header
+            Returns:
+                status, fields: see self.parse_header()
+                header: the header of the response
+                payload: the body of the response, still encoded
+        '''
+        if self.stack is not None:
+            tcp = self.stack.tcp(self.pr.netloc, 80, self.tcp_args)
+        else:
+            ip = socket.gethostbyname(self.pr.netloc)
+            tcp = TCP(ip, 80, **self.tcp_args)
+        data_out = message if body is None else SendStream(message, body)
+        res = tcp.tcp_process(data_out)
+        self.recv_stats = tcp.receiver.stats()
+        self.tcp_stats = tcp.stats
+        if self.stack is None:
+            tcp.close()
 
         CRLF = self.NEWLINE.encode()
         data = b"".join(res)
@@ -48,30 +129,113 @@ class MyHttp():
         p = data.find(seperator)
         header = data[:p].decode()
         payload = data[p+len(seperator):]
+        status, fields = self.parse_header(header)
+        return status, fields, header, payload
 
-        if "200" not in header:
-            print('Got a non-200 response')
-            print(header)
-            return
-        if "Transfer-Encoding: chunked" in header:
-            lst = payload.split(CRLF)
-            tmp = b""
-            for i in range(0, len(lst), 2):
-                length = int(lst[i].decode(), 16)
-                if length == 0:
-                    break
-                if length != len(lst[i+1]):
-                    print("Bad chunked encoding format")
-                    return -1
-                tmp += lst[i+1]
-            payload = tmp
-
+    def save(self, path: str, payload: bytes) -> int:
+        '''
+            Save the payload in self.out_dir, named after the last part of path.
+            Parameters:
+                path: the path in the URL
+                payload: the decoded body
+            Returns:
+                The number of bytes written to the output file.
+        '''
         name = path.split("/")[-1]
         if len(name) == 0:
-            with open(f"index.html", "w") as f:
+            self.output = os.path.join(self.out_dir, "index.html")
+            with open(self.output, "w") as f:
                 f.write(payload.decode())
         else:
-            with open(f"{name}", "wb") as f:
+            self.output = os.path.join(self.out_dir, name)
+            with open(self.output, "wb") as f:
                 f.write(payload)
 
         return len(payload)
+
+    def get(self, url: str) -> int:
+        '''
+            Download a resource with a URL.
+            A fresh cached copy is used without any network traffic,
+            a stale one is revalidated with If-None-Match/If-Modified-Since.
+            Parameters:
+                url: the URL of the resource
+            Returns:
+                The number of bytes written to the output file.
+                If an invalid message is received, returns -1 and does not create any file
+        '''
+        self.pr = urlparse(url)
+        path = self.pr.path
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.lookup(url)
+        if entry is not None and self.cache.is_fresh(entry):
+            payload = self.cache.load(url)
+            self.cache.record("hits", len(payload))
+            return self.save(path, payload)
+
+        extra = self.cache.validators(entry) if entry is not None else {}
+        message = self.build_get_message(extra)
+        status, fields, header, payload = self.request(message.encode())
+
+        if status == 304 and entry is not None:
+            self.cache.refresh(url, fields)
+            payload = self.cache.load(url)
+            self.cache.record("revalidated", len(payload))
+            return self.save(path, payload)
+        if status != 200:
+            print('Got a non-200 response')
+            print(header)
+            return
+        if fields.get("transfer-encoding", "").lower() == "chunked":
+            with PROFILER.span("http.chunk_decode"):
+                payload = self.decode_chunked(payload)
+            if payload is None:
+                print("Bad chunked encoding format")
+                return -1
+
+        if self.cache is not None:
+            self.cache.store(url, fields, payload)
+            self.cache.record("misses")
+        with PROFILER.span("http.write"):
+            return self.save(path, payload)
+
+    def upload(self, method: str, url: str, body) -> int:
+        '''
+            Upload a body with PUT or POST.
+            A file is streamed from disk, an iterator of bytes is sent with the chunked transfer coding.
+            Parameters:
+                method: PUT or POST
+                url: the URL of the resource
+                body: the path of a file, or an iterable of bytes
+            Returns:
+                The number of uploaded body bytes.
+                If the response is not 2xx, returns -1
+        '''
+        self.pr = urlparse(url)
+        extra = {"content-type": "application/octet-stream"}
+        if isinstance(body, str):
+            body = FileBody(body)
+            extra["content-length"] = str(len(body))
+        else:
+            body = IterBody(body)
+            extra["transfer-encoding"] = "chunked"
+        message = self.build_message(method, extra)
+        status, fields, header, payload = self.request(message.encode(), body)
+        if status // 100 != 2:
+            print('Got a non-2xx response')
+            print(header)
+            return -1
+        return body.size
+
+    def put(self, url: str, body) -> int:
+        '''
+            Upload a body with PUT, see self.upload()
+        '''
+        return self.upload("PUT", url, body)
+
+    def post(self, url: str, body) -> int:
+        '''
+            Upload a body with POST, see self.upload()
+        '''
+        return self.upload("POST", url, body)
@@ -4,21 +4,60 @@ from checksum import checksum, verify
 import random
 from collections import deque
 import time
+import os
+import functools
 from MyChallenge import EtherSend
+from Profiler import PROFILER
+
+
+@functools.lru_cache(maxsize=None)
+def local_ip() -> str:
+    '''
+        Resolves the IP of this host, only once per process
+        Parameters:
+            none
+        Returns:
+            The IP of this host
+    '''
+    return socket.gethostbyname(f"{socket.gethostname()}.local")
+
+
+def kernel_drops(sock: socket.socket) -> int:
+    '''
+        Reads how many packets the kernel dropped because the buffer of a raw socket was full
+        Parameters:
+            sock: a raw IPv4 socket
+        Returns:
+            The number of dropped packets, -1 if it is unknown
+    '''
+    try:
+        inode = os.fstat(sock.fileno()).st_ino
+        with open("/proc/net/raw") as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if int(fields[9]) == inode:
+                    return int(fields[12])
+    except (OSError, ValueError, IndexError):
+        pass
+    return -1
 
 
 class IPSender():
-    def __init__(self, dst: str) -> None:
+    # Whether the link fills TCP checksums, and the largest TCP segment it takes if it segments them
+    csum_offload = False
+    max_segment = None
+
+    def __init__(self, dst: str, es: EtherSend = None) -> None:
         '''
             Initializes an IPSender object.
-            Has a socket and an EtherSend
+            Has a socket and an EtherSend, an existing EtherSend can be shared to skip ARP
             By modifying self.take_challenge, the end point that sends bytes can be switched
         '''
-        self.ip = socket.gethostbyname(f"{socket.gethostname()}.local")
+        self.ip = local_ip()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
                                   socket.IPPROTO_RAW)
         self.dst = dst
-        self.es = EtherSend()
+        self.es = es if es is not None else EtherSend()
         self.take_challenge = True
 
     def build_ip_header(self, id: int, more: bool, data_length: int, fragment_offset: int, cksum: int) -> bytes:
@@ -78,6 +117,8 @@ class IPSender():
 
 
 class IPReceiver():
+    verifies_tcp = False
+
     def __init__(self, ) -> None:
         '''
             Initializes an IPReceiver object.
@@ -87,8 +128,9 @@ class IPReceiver():
             It assembles packets with self.consume(). If a packet is completed, it will be put into self.q
 
             The upperlevel layer can get completed IP packets from self.q
+            The TCP checksum of these packets is not verified, as self.verifies_tcp says
         '''
-        self.ip = socket.gethostbyname(f"{socket.gethostname()}.local")
+        self.ip = local_ip()
         self.sock = socket.socket(
             socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_TCP)
         self.sock.settimeout(0.0001)
@@ -154,6 +196,19 @@ class IPReceiver():
         dst = socket.inet_ntoa(dst)
         return id, more, offset, protocol, src, dst
 
+    def start(self, expect_src: str, ports=None):
+        '''
+            Called before the first packet is sent to the peer, so that a receiver
+            that needs time to get ready does not miss the replies. The socket is already open here.
+
+            Parameters:
+                expect_src: the IP of the peer
+                ports: (the port of the peer, my port), a receiver may drop the segments of other connections
+            Returns:
+                none
+        '''
+        pass
+
     def recv(self, expect_src: str, timeout):
         '''
             Receives packets for a while. Packets are given to self.consume()
@@ -167,7 +222,8 @@ class IPReceiver():
         start = time.time()
         while time.time()-start < timeout:
             try:
-                packet, (ip, port) = self.sock.recvfrom(65535)
+                with PROFILER.span("ip.recvfrom"):
+                    packet, (ip, port) = self.sock.recvfrom(65535)
                 if ip != expect_src:
                     # This is not a packet I am waiting for
                     continue
@@ -186,7 +242,8 @@ class IPReceiver():
                     continue
                 if src != expect_src or dst != self.ip:
                     continue
-                self.consume(id, more, offset, data)
+                with PROFILER.span("ip.consume"):
+                    self.consume(id, more, offset, data)
             except socket.timeout:
                 break
 
@@ -214,3 +271,48 @@ class IPReceiver():
         if ttl != len(packet):
             return None
         return header, data
+
+    def verify_segment(self, segment: bytes, src: str) -> bool:
+        '''
+            Verifies the TCP checksum of a segment sent to this host
+
+            Parameters:
+                segment: a TCP segment
+                src: the source IP
+            Returns:
+                Whether the TCP checksum of segment is correct
+        '''
+        ph = pack("!4s4sBBH", socket.inet_aton(src), socket.inet_aton(self.ip), 0,
+                  socket.IPPROTO_TCP, len(segment))
+        return verify(ph+segment)
+
+    def reset(self):
+        '''
+            Forgets the packets of previous connections, so that the receiver can be reused
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        self.container.clear()
+        self.q.clear()
+        self.last_recv = time.time()
+
+    def stats(self) -> dict:
+        '''
+            Parameters:
+                none
+            Returns:
+                The counters of this receiver
+        '''
+        return {"kernel_drops": kernel_drops(self.sock)}
+
+    def close(self):
+        '''
+            Closes the socket
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        self.sock.close()
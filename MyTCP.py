@@ -3,9 +3,14 @@ from struct import pack, unpack
 import socket
 from checksum import checksum, verify
 from MyIP import IPReceiver, IPSender
+from RecvPipeline import PipelineReceiver
+from Congestion import ALGORITHMS
+from SendStream import SendStream
+from Pacer import Pacer, RttEstimator
+from Profiler import PROFILER
+from MyTun import TunReceiver, TunSender
 import random
 import time
-from collections import deque
 
 
 class TCP():
@@ -16,22 +21,55 @@ class TCP():
         3. consume received packets in order
         4. is able to handle seq/ack number wrap-around
         5. manage my seq/ack and server's seq/ack
+        6. pluggable congestion control with fast retransmit and fast recovery
+        7. stream large data, respecting the peer's receive window, with zero-window probing
+        8. optionally pace data segments at a rate derived from cwnd/RTT
+        9. run over a TUN device with checksum and segmentation offload instead of raw sockets
     '''
     mod = 1 << 32
+    mss = 1460
+    probe_interval = 0.2
+    max_probe_interval = 60
 
-    def __init__(self, ip: str, port: int) -> None:
+    def __init__(self, ip: str, port: int, recv_process: bool = False, batch: int = 0,
+                 cc: str = "newreno", pacing: bool = False, pacing_rate: float = None,
+                 receiver=None, ips: IPSender = None, tun=None) -> None:
         '''
             Has an IPReceiver and an IPHeader.
             Keeps the IP and Port of both side
+            If recv_process is True, packets are received and verified by a dedicated process
+            If batch is positive, up to batch packets are received and verified at once with NumPy
+            cc names the congestion control algorithm, one of Congestion.ALGORITHMS
+            If pacing is True or pacing_rate (bytes per second) is given, data segments go through a Pacer
+            An existing receiver and IPSender can be given to reuse them, then recv_process and batch are ignored
+            If a MyTun.TunDevice is given as tun, packets are sent and received through it instead
 
             Note that seq/ack for both side are created when self.connect() is called.
             They are stored in real value, namely they can be more than 32 bits
         '''
-        self.receiver = IPReceiver()
-        self.ips = IPSender(ip)
+        if tun is not None:
+            receiver = TunReceiver(tun)
+            ips = TunSender(ip, tun, self.mss)
+        if receiver is not None:
+            self.receiver = receiver
+        elif recv_process:
+            self.receiver = PipelineReceiver()
+        elif batch > 0:
+            # NumPy is only imported when the batch path is used, it costs tens of ms at startup
+            from BatchRecv import BatchIPReceiver
+            self.receiver = BatchIPReceiver(batch)
+        else:
+            self.receiver = IPReceiver()
+        self.ips = ips if ips is not None else IPSender(ip)
+        self.congestion = ALGORITHMS[cc]
+        self.rtt = RttEstimator()
+        self.pacer = None
+        if pacing or pacing_rate:
+            self.pacer = Pacer(self.ips, pacing_rate, rtt=self.rtt)
+        self.stats = {"segments": 0, "retransmits": 0, "timeouts": 0, "probes": 0}
         self.dst_ip = ip
         self.dst_port = port
-        self.src_ip = socket.gethostbyname(f"{socket.gethostname()}.local")
+        self.src_ip = self.ips.ip
 
     def build_tcp_pseudo_header(self, tcp_packet_length: int) -> bytes:
         '''
@@ -106,7 +144,7 @@ class TCP():
             "!HHLLBBHHH", packet[:20])
         offset >>= 4
         ph = self.build_tcp_pseudo_header(len(packet))
-        if not verify(ph+packet):
+        if not self.receiver.verifies_tcp and not verify(ph+packet):
             # print(f"Bad packet, seq={seq}, cksum={cksum}")
             return None
         data = packet[4*offset:]
@@ -121,7 +159,7 @@ class TCP():
                  (control >> 0) & 1),
                 window), data
 
-    def send(self, data: bytes, control, seq=None):
+    def send(self, data: bytes, control, seq=None, expect_ack=None):
         '''
             Send a TCP packet
 
@@ -129,6 +167,7 @@ class TCP():
                 data: data in bytes
                 control: the six control bits
                 seq: sequence number
+                expect_ack: the ACK number that confirms new data, to time it for the RTT when it leaves
             Returns:
                 none
         '''
@@ -139,10 +178,20 @@ class TCP():
         header = self.build_tcp_header(*args)
 
         ph = self.build_tcp_pseudo_header(len(header+data))
-        args[5] = int.from_bytes(checksum(ph+header+data), "big")
+        if self.ips.csum_offload:
+            # the link completes the checksum, it only needs the sum of the pseudo header
+            args[5] = int.from_bytes(checksum(ph), "big") ^ 0xffff
+        else:
+            args[5] = int.from_bytes(checksum(ph+header+data), "big")
         header = self.build_tcp_header(*args)
         packet = header+data
-        self.ips.send(packet)
+        # FIN is paced too, so that it does not overtake queued data
+        if self.pacer is not None and (len(data) or control[5]):
+            self.pacer.send(packet, expect_ack)
+        else:
+            self.ips.send(packet)
+            if expect_ack is not None:
+                self.rtt.on_send(expect_ack)
 
     def connect(self):
         '''
@@ -155,6 +204,7 @@ class TCP():
         '''
         self.my_seq = self.server_ack = random.randint(0, self.mod-1)
         self.my_ack = self.server_seq = 0
+        self.receiver.start(self.dst_ip, (self.dst_port, self.src_port))
 
         retry = 3
         synced = False
@@ -179,13 +229,80 @@ class TCP():
                     continue
                 self.my_ack = self.server_seq = seq+1
                 self.my_seq = self.server_ack = self.my_seq + 1
+                self.peer_window = window
                 synced = True
         if not synced:
             print("TCP connection failed")
             exit()
         self.send(b"", (0, 1, 0, 0, 0, 0))
 
-    def tcp_process(self, data_out: bytes):
+    def resend_first(self, send_buf: SendBuffer):
+        '''
+            Resends the first unACKed segment, used by fast retransmit and fast recovery
+
+            Parameters:
+                send_buf: the SendBuffer keeping unACKed segments
+            Returns:
+                none
+        '''
+        entry = send_buf.first_after(self.server_ack)
+        if entry is not None:
+            ack, (seq, data, control) = entry
+            self.stats["retransmits"] += 1
+            self.rtt.on_retransmit()
+            self.send(data, control, seq)
+
+    def can_send(self, cc, size: int) -> bool:
+        '''
+            Checks both the congestion window and the peer's receive window
+
+            Parameters:
+                cc: the CongestionControl of the connection
+                size: the size of the next segment
+            Returns:
+                Whether a segment of size bytes can be sent now
+        '''
+        inflight = self.my_seq-self.server_ack
+        return cc.can_send(inflight, size) and inflight+size <= self.peer_window
+
+    def segment_size(self, cc) -> int:
+        '''
+            Parameters:
+                cc: the CongestionControl of the connection
+            Returns:
+                The size of the next segment: the MSS, or if the link segments large ones,
+                as many MSS as both windows allow, up to what the link takes.
+                If the peer's window is smaller than one MSS and nothing is in flight, the window,
+                since waiting for a larger one would stall the connection
+        '''
+        if self.my_seq == self.server_ack and 0 < self.peer_window < self.mss:
+            return self.peer_window
+        if self.ips.max_segment is None:
+            return self.mss
+        room = min(cc.cwnd, self.peer_window)-(self.my_seq-self.server_ack)
+        return max(self.mss, min(self.ips.max_segment, room//self.mss*self.mss))
+
+    def send_segment(self, data: bytes, send_buf: SendBuffer):
+        '''
+            Sends data with the next sequence number, and keeps it until it is ACKed
+
+            Parameters:
+                data: data in bytes, may be empty to send an ACK only
+                send_buf: the SendBuffer keeping unACKed segments
+            Returns:
+                none
+        '''
+        control = (0, 1, 0, 0, 0, 0)
+        if len(data):
+            self.send(data, control, expect_ack=self.my_seq+len(data))
+            send_buf.push(self.my_seq+len(data),
+                          (self.my_seq, data, control))
+            self.stats["segments"] += 1
+        else:
+            self.send(data, control)
+        self.my_seq += len(data)
+
+    def tcp_process(self, data_out):
         '''
             Sends data_out and keeps receiving until tear down
 
@@ -194,22 +311,27 @@ class TCP():
             connect()
             while connection is not closed:
                 while I want to send something OR I want to send an ACK:
-                    do it
+                    do it if both cwnd and the peer's window allow
+                if the peer's window is zero for a while:
+                    send an empty probe below its window
+                release the segments the pacer allows
                 if I have sent everything but have not sent FIN:
                     send FIN
-                while some packet sent before has not been ACKed:
+                while some packet sent before has not been ACKed in time:
                     if it is covered by a larger ACK number:
                         ignore it
                     else:
-                        resend it
-                let the receiver receive for a short time
+                        resend it and tell congestion control about the timeout
+                let the receiver receive for a short time, or until the pacer can release more
                 while the queue of the receiver is not empty:
+                    pass new ACKs and duplicate ACKs to congestion control,
+                        and fast retransmit if it asks to
                     put these packets into recv_buf for the next step
                 while the next bytes I want to receive is in recv_buf:
                     consume it and update related seq/ack
 
             Parameters:
-                data_out: the data from upper level
+                data_out: the data from upper level, bytes or a SendStream
             Returns:
                 none
         '''
@@ -223,71 +345,123 @@ class TCP():
         send_buf = SendBuffer()
         recv_buf = {}
         ret = []
-        pending_sends = deque([data_out])
-        cwnd = 1
+        stream = data_out if isinstance(data_out, SendStream) else SendStream(data_out)
+        cc = self.congestion(self.mss)
+        probe_at, probe_interval = None, self.probe_interval
 
         downloaded_bytes = 0
         start = last = time.time()
-        while (not my_fin) or (not server_fin) or self.my_ack < next_ack or len(pending_sends) or send_buf.size():
+        while (not my_fin) or (not server_fin) or self.my_ack < next_ack or stream.pending() or send_buf.size():
             # if time.time()-last > 3:
             #     last = time.time()
             #     print(
-            #         f"total {int(last-start)} {downloaded_bytes/1024}KB downloaded, cwnd={cwnd}")
-            while (len(pending_sends) and send_buf.size() < cwnd) or self.my_ack < next_ack:
-                data = b""
-                if (len(pending_sends) and send_buf.size() < cwnd):
-                    data = pending_sends.popleft()
-                control = (0, 1, 0, 0, 0, 0)
+            #         f"total {int(last-start)} {downloaded_bytes/1024}KB downloaded, cwnd={cc.cwnd}")
+            while True:
+                data = stream.peek(self.segment_size(cc))
+                if not self.can_send(cc, len(data)):
+                    data = b""
+                if len(data) == 0 and self.my_ack >= next_ack:
+                    break
+                stream.advance(len(data))
                 self.my_ack = max(next_ack, self.my_ack)
-                self.send(data, control)
-                if len(data):
-                    send_buf.push(self.my_seq+len(data),
-                                  (self.my_seq, data, control))
-                self.my_seq += len(data)
+                self.send_segment(data, send_buf)
+
+            if stream.pending() and self.peer_window == 0:
+                if probe_at is None:
+                    probe_at = time.time()+probe_interval
+                elif time.time() >= probe_at:
+                    # an empty segment below the window, which the peer answers with its current window.
+                    # Unlike a byte of new data, it cannot be dropped and leave a hole once the window opens
+                    self.send(b"", (0, 1, 0, 0, 0, 0), self.server_ack-1)
+                    self.stats["probes"] += 1
+                    probe_interval = min(probe_interval*2, self.max_probe_interval)
+                    probe_at = time.time()+probe_interval
+            else:
+                probe_at, probe_interval = None, self.probe_interval
 
-            if len(pending_sends) == 0 and (not my_fin):
+            if (not stream.pending()) and (not my_fin):
                 control = (0, 1, 0, 0, 0, 1)
                 self.send(b"", control)
                 send_buf.push(self.my_seq+1, (self.my_seq, b"", control))
                 self.my_seq += 1
                 my_fin = True
 
+            timed_out = False
             while send_buf.should_send() or (my_fin and server_fin and send_buf.size()):
+                expired = send_buf.should_send()
                 ack, (seq, data, control) = send_buf.get()
                 if self.server_ack >= ack:
                     send_buf.confirm(ack)
                 else:
-                    cwnd = 1
+                    if expired and not timed_out:
+                        cc.on_timeout(self.my_seq-self.server_ack)
+                        self.stats["timeouts"] += 1
+                        timed_out = True
+                    self.stats["retransmits"] += 1
+                    self.rtt.on_retransmit()
                     self.send(data, control, seq)
 
-            self.receiver.recv(self.dst_ip, 0.001)
+            timeout = 0.001
+            if self.pacer is not None:
+                self.pacer.update(cc.cwnd, self.rtt.srtt, cc.cwnd < cc.ssthresh)
+                self.pacer.flush()
+                delay = self.pacer.delay()
+                if delay is not None:
+                    timeout = min(timeout, delay)
+            with PROFILER.span("ip.recv"):
+                self.receiver.recv(self.dst_ip, timeout)
             while len(self.receiver.q):
                 packet = self.receiver.q.popleft()
-                res = self.parse_tcp_packet(packet)
+                with PROFILER.span("tcp.parse"):
+                    res = self.parse_tcp_packet(packet)
                 if res is None:
                     continue
                 (sp, dp, seq, ack, control, window), data_in = res
                 if sp != self.dst_port or dp != self.src_port:
                     continue
+                u, a, p, r, s, f = control
+                if a and self.server_ack < ack <= self.my_seq:
+                    acked = ack-self.server_ack
+                    self.server_ack = ack
+                    send_buf.confirm_upto(ack)
+                    self.rtt.on_ack(ack)
+                    if cc.on_ack(ack, acked, self.my_seq-self.server_ack):
+                        self.resend_first(send_buf)
+                elif a and ack == self.server_ack and self.my_seq > self.server_ack \
+                        and len(data_in) == 0 and not (s or f) and window == self.peer_window \
+                        and self.peer_window != 0 and probe_at is None:
+                    # the ACKs of zero-window probes are flow control, not a sign of loss
+                    if cc.on_dup_ack(self.my_seq-self.server_ack, self.my_seq):
+                        self.resend_first(send_buf)
+                if a and ack >= self.server_ack:
+                    self.peer_window = window
                 if self.server_seq <= seq:
                     recv_buf[seq] = (ack, control, window, data_in)
                 else:
                     self.my_ack -= 1
 
-            while self.server_seq in recv_buf:
-                (ack, control, window, data_in) = recv_buf.pop(self.server_seq)
-                if len(data_in):
-                    ret.append(data_in)
-                    downloaded_bytes += len(data_in)
-                self.server_seq += len(data_in)
-                u, a, p, r, s, f = control
-                if a:
-                    self.server_ack = max(self.server_ack, ack)
-                    send_buf.confirm(ack)
-                    cwnd = min(cwnd+1, 1000)
-                if f:
-                    self.server_seq += 1
-                    server_fin = True
-                next_ack = max(next_ack, self.server_seq)
+            with PROFILER.span("tcp.recv_buf_drain"):
+                while self.server_seq in recv_buf:
+                    (ack, control, window, data_in) = recv_buf.pop(self.server_seq)
+                    if len(data_in):
+                        ret.append(data_in)
+                        downloaded_bytes += len(data_in)
+                    self.server_seq += len(data_in)
+                    u, a, p, r, s, f = control
+                    if f:
+                        self.server_seq += 1
+                        server_fin = True
+                    next_ack = max(next_ack, self.server_seq)
         # print(f"done! {time.time()-start}s")
         return ret
+
+    def close(self):
+        '''
+            Releases the receiver
+
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        self.receiver.close()
@@ -0,0 +1,220 @@
+import fcntl
+import os
+import select
+import socket
+import struct
+import time
+from collections import deque
+from struct import pack, unpack
+from checksum import checksum
+from MyIP import IPReceiver, IPSender
+from Profiler import PROFILER
+
+
+class TunDevice():
+    '''
+        A TUN device opened with IFF_VNET_HDR.
+
+        Every packet read or written is prefixed with a virtio-net header, which lets the kernel:
+        1. fill the TCP checksum (NEEDS_CSUM), so the stack only puts the pseudo header sum in it
+        2. split large TCP segments into gso_size pieces (GSO), so the stack sends up to 64KB at once
+        3. pass GRO-coalesced segments and tell whether their checksum was already verified (DATA_VALID)
+
+        The device is expected to exist, e.g. created by `make tun`, and the stack uses an address
+        in its subnet that the kernel does not own, so no raw socket, no root and no RST-drop rule is needed.
+    '''
+    TUNSETIFF = 0x400454ca
+    TUNSETOFFLOAD = 0x400454d0
+    TUNSETVNETHDRSZ = 0x400454d8
+    IFF_TUN = 0x0001
+    IFF_NO_PI = 0x1000
+    IFF_VNET_HDR = 0x4000
+    TUN_F_CSUM = 0x01
+    TUN_F_TSO4 = 0x02
+
+    F_NEEDS_CSUM = 1
+    F_DATA_VALID = 2
+    GSO_NONE = 0
+    GSO_TCPV4 = 1
+
+    # flags, gso_type, hdr_len, gso_size, csum_start, csum_offset in native byte order
+    VNET_HDR = "=BBHHHH"
+    VNET_HDR_LEN = struct.calcsize(VNET_HDR)
+
+    def __init__(self, name: str, ip: str) -> None:
+        '''
+            Attaches to a TUN device
+            Parameters:
+                name: the name of the device
+                ip: the address the stack uses, in the subnet of the device
+        '''
+        self.name = name
+        self.ip = ip
+        self.fd = os.open("/dev/net/tun", os.O_RDWR | os.O_NONBLOCK)
+        ifr = pack("16sH", name.encode(),
+                   self.IFF_TUN | self.IFF_NO_PI | self.IFF_VNET_HDR)
+        fcntl.ioctl(self.fd, self.TUNSETIFF, ifr)
+        fcntl.ioctl(self.fd, self.TUNSETVNETHDRSZ, pack("i", self.VNET_HDR_LEN))
+        fcntl.ioctl(self.fd, self.TUNSETOFFLOAD, self.TUN_F_CSUM | self.TUN_F_TSO4)
+        self.frames = 0
+        self.coalesced = 0
+
+    def write(self, packet: bytes, gso_size: int):
+        '''
+            Writes an IPv4 packet carrying a TCP segment whose checksum field keeps the pseudo header sum
+            Parameters:
+                packet: the IP packet
+                gso_size: the size of the pieces the kernel splits the segment into
+            Returns:
+                none
+        '''
+        ihl = (packet[0] & 0xf)*4
+        tcp_len = (packet[ihl+12] >> 4)*4
+        gso_type = self.GSO_NONE
+        if len(packet)-ihl-tcp_len > gso_size:
+            gso_type = self.GSO_TCPV4
+        header = pack(self.VNET_HDR, self.F_NEEDS_CSUM, gso_type, ihl+tcp_len,
+                      gso_size if gso_type != self.GSO_NONE else 0, ihl, 16)
+        os.write(self.fd, header+packet)
+
+    def read(self, timeout: float):
+        '''
+            Reads a packet
+            Parameters:
+                timeout: the maximum waiting time
+            Returns:
+                trusted: whether the kernel vouches for the TCP checksum
+                packet: the IP packet
+                or none if nothing arrives in time
+        '''
+        try:
+            frame = os.read(self.fd, 65536+self.VNET_HDR_LEN)
+        except BlockingIOError:
+            if not select.select([self.fd], [], [], timeout)[0]:
+                return None
+            frame = os.read(self.fd, 65536+self.VNET_HDR_LEN)
+        flags, gso_type = unpack(self.VNET_HDR, frame[:self.VNET_HDR_LEN])[:2]
+        self.frames += 1
+        if gso_type != self.GSO_NONE:
+            self.coalesced += 1
+        trusted = (flags & (self.F_NEEDS_CSUM | self.F_DATA_VALID)) != 0
+        return trusted, frame[self.VNET_HDR_LEN:]
+
+    def close(self):
+        '''
+            Detaches from the device, which stays for the next run
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        os.close(self.fd)
+
+
+class TunSender(IPSender):
+    '''
+        An IPSender writing to a TunDevice.
+        Segments are not fragmented: TCP hands over segments of up to self.max_segment bytes,
+        and the kernel segments them and fills their checksums.
+    '''
+    csum_offload = True
+    max_segment = 44*1460
+
+    def __init__(self, dst: str, tun: TunDevice, mss: int = 1460) -> None:
+        '''
+            Parameters:
+                dst: the IP of the peer
+                tun: the TunDevice
+                mss: the size of the segments on the wire
+        '''
+        self.ip = tun.ip
+        self.dst = dst
+        self.tun = tun
+        self.mss = mss
+
+    def send(self, data: bytes):
+        '''
+            Sends a TCP segment in one IP packet
+            Parameters:
+                data: the TCP segment
+            Returns:
+                none
+        '''
+        args = [0, False, len(data), 0, 0]
+        header = self.build_ip_header(*args)
+        args[4] = int.from_bytes(checksum(header), "big")
+        header = self.build_ip_header(*args)
+        self.tun.write(header+data, self.mss)
+
+
+class TunReceiver(IPReceiver):
+    '''
+        An IPReceiver reading from a TunDevice.
+        Like BatchIPReceiver, it only puts TCP segments with a valid checksum into self.q:
+        the checksum is skipped when the kernel vouches for it, otherwise it is verified here.
+    '''
+    verifies_tcp = True
+
+    def __init__(self, tun: TunDevice) -> None:
+        '''
+            Parameters:
+                tun: the TunDevice
+        '''
+        self.ip = tun.ip
+        self.tun = tun
+        self.container = {}
+        self.q = deque()
+        self.last_recv = time.time()
+
+    def recv(self, expect_src: str, timeout):
+        '''
+            Receives packets for a while. Packets are given to self.consume()
+
+            Parameters:
+                expect_src: as its name
+                timeout: the maximum receiving time
+            Returns:
+                none
+        '''
+        start = time.time()
+        while time.time()-start < timeout:
+            with PROFILER.span("tun.read"):
+                res = self.tun.read(0.0001)
+            if res is None:
+                break
+            trusted, packet = res
+            res = self.ip_packet_split(packet)
+            if not res:
+                continue
+            header, data = res
+            id, more, offset, protocol, src, dst = self.parse_ip_header(header)
+            if protocol != socket.IPPROTO_TCP or src != expect_src or dst != self.ip:
+                continue
+            if time.time()-self.last_recv > 180:
+                print("Connection failed")
+                exit()
+            self.last_recv = time.time()
+            count = len(self.q)
+            with PROFILER.span("ip.consume"):
+                self.consume(id, more, offset, data)
+            if len(self.q) > count and not trusted and not self.verify_segment(self.q[-1], expect_src):
+                self.q.pop()
+
+    def stats(self) -> dict:
+        '''
+            Parameters:
+                none
+            Returns:
+                The number of frames read, and how many of them were coalesced by the kernel
+        '''
+        return {"frames": self.tun.frames, "coalesced": self.tun.coalesced}
+
+    def close(self):
+        '''
+            The device is owned by whoever created the TunDevice, so it is not closed here
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        pass
@@ -0,0 +1,162 @@
+import time
+from collections import deque
+
+
+class RttEstimator():
+    '''
+        Smoothed RTT from the ACKs of segments, as in RFC 6298.
+        Segments are kept in the order they are sent, a cumulative ACK gives a sample
+        from the newest segment it covers.
+        Following Karn's algorithm, no sample is taken from segments sent before a retransmission.
+    '''
+    alpha = 1/8
+
+    def __init__(self) -> None:
+        '''
+            Starts without samples, self.srtt is none until the first one
+        '''
+        self.srtt = None
+        self.sent = deque()
+
+    def on_send(self, expect_ack: int):
+        '''
+            Parameters:
+                expect_ack: the ACK number that confirms the segment just sent
+            Returns:
+                none
+        '''
+        self.sent.append((expect_ack, time.perf_counter()))
+
+    def on_ack(self, ack: int):
+        '''
+            Parameters:
+                ack: a new cumulative ACK number
+            Returns:
+                none
+        '''
+        sent_at = None
+        while len(self.sent) and self.sent[0][0] <= ack:
+            sent_at = self.sent.popleft()[1]
+        if sent_at is None:
+            return
+        sample = time.perf_counter()-sent_at
+        if self.srtt is None:
+            self.srtt = sample
+        else:
+            self.srtt += self.alpha*(sample-self.srtt)
+
+    def on_retransmit(self):
+        '''
+            Forgets the segments in flight, since their ACKs are ambiguous
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        self.sent.clear()
+
+
+class Pacer():
+    '''
+        Sits between TCP and IPSender, and releases packets at a limited rate with a token bucket.
+
+        The bucket is refilled by a monotonic high-resolution clock. A packet can leave whenever
+        the bucket is not empty, and takes its size in tokens, so the bucket may go into debt.
+        Packets that cannot leave wait in a queue. TCP calls self.flush() on every iteration
+        and waits at most self.delay() seconds for packets, so there is no busy waiting.
+        A segment is reported to the RttEstimator when it leaves, so the queueing delay is not taken as RTT.
+    '''
+    # Pace faster than cwnd/RTT so that the pacer does not limit the growth of cwnd, like Linux does
+    slow_start_gain = 2.0
+    gain = 1.2
+
+    def __init__(self, ips, cap: float = None, burst: int = 2*1460, rtt: RttEstimator = None) -> None:
+        '''
+            Parameters:
+                ips: the IPSender
+                cap: the maximum rate in bytes per second, none for no limit
+                burst: the size of the bucket in bytes
+                rtt: the RttEstimator told when segments leave, or none
+        '''
+        self.ips = ips
+        self.rtt = rtt
+        self.cap = cap
+        self.rate = cap
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.perf_counter()
+        self.q = deque()
+
+    def update(self, cwnd: int, srtt, slow_start: bool):
+        '''
+            Derives the rate from the congestion window and the smoothed RTT, limited by self.cap
+            Parameters:
+                cwnd: the congestion window in bytes
+                srtt: the smoothed RTT in seconds, none if it is unknown
+                slow_start: whether the connection is in slow start
+            Returns:
+                none
+        '''
+        if srtt is None or srtt <= 0:
+            self.rate = self.cap
+            return
+        gain = self.slow_start_gain if slow_start else self.gain
+        rate = gain*cwnd/srtt
+        self.rate = rate if self.cap is None else min(rate, self.cap)
+
+    def refill(self):
+        '''
+            Adds the tokens earned since the last refill, up to the size of the bucket
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        now = time.perf_counter()
+        if self.rate is None:
+            self.tokens = self.burst
+        else:
+            self.tokens = min(self.burst, self.tokens+(now-self.last)*self.rate)
+        self.last = now
+
+    def send(self, packet: bytes, expect_ack: int = None):
+        '''
+            Queues a packet and releases as many packets as the bucket allows
+            Parameters:
+                packet: a TCP packet
+                expect_ack: the ACK number that confirms the packet if it is timed for the RTT, otherwise none
+            Returns:
+                none
+        '''
+        self.q.append((packet, expect_ack))
+        self.flush()
+
+    def flush(self):
+        '''
+            Releases the queued packets the bucket allows
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        self.refill()
+        while len(self.q) and self.tokens > 0:
+            packet, expect_ack = self.q.popleft()
+            self.tokens -= len(packet)
+            self.ips.send(packet)
+            if expect_ack is not None and self.rtt is not None:
+                self.rtt.on_send(expect_ack)
+
+    def delay(self):
+        '''
+            Parameters:
+                none
+            Returns:
+                Seconds until the next queued packet can leave, or none if the queue is empty
+        '''
+        if len(self.q) == 0:
+            return None
+        self.refill()
+        if self.tokens > 0 or not self.rate:
+            return 0
+        return -self.tokens/self.rate
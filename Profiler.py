@@ -0,0 +1,163 @@
+import json
+import time
+from contextlib import nullcontext
+
+
+class Stage():
+    '''
+        Call count, total time and a latency histogram of one stage.
+        Bucket i counts the calls that took [2^(i-1), 2^i) nanoseconds.
+    '''
+
+    def __init__(self) -> None:
+        '''
+            Starts with no calls
+        '''
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.buckets = [0]*64
+
+    def add(self, ns: int):
+        '''
+            Records a call
+            Parameters:
+                ns: the duration of the call in nanoseconds
+            Returns:
+                none
+        '''
+        self.count += 1
+        self.total += ns
+        self.max = max(self.max, ns)
+        self.buckets[min(ns.bit_length(), 63)] += 1
+
+    def percentile(self, p: float) -> int:
+        '''
+            Parameters:
+                p: between 0 and 1
+            Returns:
+                The upper bound in nanoseconds of the bucket holding the p-th call
+        '''
+        rank = p*self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(1 << i, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        '''
+            Parameters:
+                none
+            Returns:
+                The summary of the stage, with times in milliseconds or microseconds
+        '''
+        return {
+            "count": self.count,
+            "total_ms": self.total/1e6,
+            "mean_us": self.total/self.count/1e3 if self.count else 0,
+            "p50_us": self.percentile(0.5)/1e3,
+            "p99_us": self.percentile(0.99)/1e3,
+            "max_us": self.max/1e3,
+            "histogram": {f"<{(1 << i)/1e3:g}us": n for i, n in enumerate(self.buckets) if n},
+        }
+
+
+class Span():
+    '''
+        Times the code in a with block and adds it to a stage
+    '''
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: Stage) -> None:
+        '''
+            Parameters:
+                stage: the Stage the time is added to
+        '''
+        self.stage = stage
+
+    def __enter__(self):
+        '''
+            Starts the clock
+        '''
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc):
+        '''
+            Adds the time since self.__enter__() to the stage, also when the block raises
+        '''
+        self.stage.add(time.perf_counter_ns()-self.start)
+
+
+class Profiler():
+    '''
+        Named timing spans around the stages of the stack:
+
+            with PROFILER.span("checksum"):
+                ...
+
+        When the profiler is disabled, span() returns a shared no-op context manager,
+        so the cost is one method call.
+    '''
+    NULL = nullcontext()
+
+    def __init__(self) -> None:
+        '''
+            Starts disabled and without stages
+        '''
+        self.enabled = False
+        self.stages = {}
+
+    def span(self, name: str):
+        '''
+            Parameters:
+                name: the name of the stage
+            Returns:
+                A context manager timing its block
+        '''
+        if not self.enabled:
+            return self.NULL
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        return Span(stage)
+
+    def to_dict(self) -> dict:
+        '''
+            Parameters:
+                none
+            Returns:
+                The summary of every stage by name
+        '''
+        return {name: stage.to_dict() for name, stage in sorted(self.stages.items())}
+
+    def table(self) -> str:
+        '''
+            Parameters:
+                none
+            Returns:
+                A summary table of all stages
+        '''
+        lines = [f"{'stage':<22}{'calls':>10}{'total ms':>12}{'mean us':>10}{'p50 us':>10}{'p99 us':>10}{'max us':>10}"]
+        for name, d in self.to_dict().items():
+            lines.append(f"{name:<22}{d['count']:>10}{d['total_ms']:>12.1f}{d['mean_us']:>10.1f}"
+                         f"{d['p50_us']:>10.1f}{d['p99_us']:>10.1f}{d['max_us']:>10.1f}")
+        return "\n".join(lines)
+
+    def dump(self, path: str = None):
+        '''
+            Prints the summary table, or writes the summary in JSON if path is given
+            Parameters:
+                path: the path of the JSON file
+            Returns:
+                none
+        '''
+        if path is None:
+            print(self.table())
+            return
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+PROFILER = Profiler()
@@ -0,0 +1,343 @@
+import multiprocessing
+import time
+from collections import deque
+from multiprocessing import shared_memory
+from struct import pack, pack_into, unpack_from
+from MyIP import IPReceiver, kernel_drops, local_ip
+
+
+class SharedRing():
+    '''
+        A single-producer single-consumer ring buffer in shared memory.
+
+        Records are stored as a 4-byte length followed by the data and may wrap around the end.
+        The producer only writes head and the consumer only writes tail, both are byte counters
+        that never wrap, so no lock is needed.
+        The header also keeps a stop flag, a ready flag and some counters written by the producer.
+    '''
+    HEAD, TAIL, STOP, READY, COUNTERS_AT = 0, 8, 16, 24, 32
+    COUNTERS = ("packets", "bytes", "bad_checksum", "stalls", "kernel_drops")
+    HEADER = COUNTERS_AT+8*len(COUNTERS)
+
+    def __init__(self, capacity: int = 8 << 20, name: str = None) -> None:
+        '''
+            Creates a ring, or attaches to an existing one if name is given
+            Parameters:
+                capacity: the size of the data area in bytes
+                name: the name of an existing shared memory block
+        '''
+        if name is None:
+            self.shm = shared_memory.SharedMemory(
+                create=True, size=self.HEADER+capacity)
+            self.shm.buf[:self.HEADER] = bytes(self.HEADER)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.buf = self.shm.buf
+        self.capacity = len(self.buf)-self.HEADER
+
+    def load(self, offset: int) -> int:
+        '''
+            Parameters:
+                offset: the offset of a 64-bit field in the header
+            Returns:
+                The value of the field
+        '''
+        return unpack_from("Q", self.buf, offset)[0]
+
+    def store(self, offset: int, value: int):
+        '''
+            Parameters:
+                offset: the offset of a 64-bit field in the header
+                value: the new value of the field
+            Returns:
+                none
+        '''
+        pack_into("Q", self.buf, offset, value)
+
+    def write(self, pos: int, data: bytes):
+        '''
+            Copies data into the data area at pos, wrapping around the end
+            Parameters:
+                pos: the byte counter where data starts
+                data: as its name
+            Returns:
+                none
+        '''
+        start = pos % self.capacity
+        first = min(len(data), self.capacity-start)
+        base = self.HEADER+start
+        self.buf[base:base+first] = data[:first]
+        if first < len(data):
+            self.buf[self.HEADER:self.HEADER+len(data)-first] = data[first:]
+
+    def read(self, pos: int, length: int) -> bytes:
+        '''
+            Copies length bytes out of the data area at pos, wrapping around the end
+            Parameters:
+                pos: the byte counter where the bytes start
+                length: the number of bytes
+            Returns:
+                The bytes
+        '''
+        start = pos % self.capacity
+        first = min(length, self.capacity-start)
+        base = self.HEADER+start
+        data = bytes(self.buf[base:base+first])
+        if first < length:
+            data += bytes(self.buf[self.HEADER:self.HEADER+length-first])
+        return data
+
+    def push(self, data: bytes) -> bool:
+        '''
+            Appends a record. Only the producer calls it.
+            Parameters:
+                data: the record
+            Returns:
+                False if there is not enough free space
+        '''
+        head = self.load(self.HEAD)
+        if self.capacity-(head-self.load(self.TAIL)) < 4+len(data):
+            return False
+        self.write(head, pack("I", len(data)))
+        self.write(head+4, data)
+        self.store(self.HEAD, head+4+len(data))
+        return True
+
+    def pop(self):
+        '''
+            Removes the oldest record. Only the consumer calls it.
+            Parameters:
+                none
+            Returns:
+                The record, or none if the ring is empty
+        '''
+        tail = self.load(self.TAIL)
+        if tail == self.load(self.HEAD):
+            return None
+        length = unpack_from("I", self.read(tail, 4))[0]
+        data = self.read(tail+4, length)
+        self.store(self.TAIL, tail+4+length)
+        return data
+
+    def count(self, name: str, n: int = 1):
+        '''
+            Adds n to a counter. Only the producer calls it.
+            Parameters:
+                name: one of self.COUNTERS
+                n: as its name
+            Returns:
+                none
+        '''
+        offset = self.COUNTERS_AT+8*self.COUNTERS.index(name)
+        self.store(offset, self.load(offset)+n)
+
+    def set_count(self, name: str, value: int):
+        '''
+            Sets a counter. Only the producer calls it.
+            Parameters:
+                name: one of self.COUNTERS
+                value: the new value
+            Returns:
+                none
+        '''
+        self.store(self.COUNTERS_AT+8*self.COUNTERS.index(name), value)
+
+    def counters(self) -> dict:
+        '''
+            Parameters:
+                none
+            Returns:
+                The value of every counter by name
+        '''
+        return {name: self.load(self.COUNTERS_AT+8*i) for i, name in enumerate(self.COUNTERS)}
+
+    def stop(self):
+        '''
+            Asks the producer to stop. Only the consumer calls it.
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        self.store(self.STOP, 1)
+
+    def stopped(self) -> bool:
+        '''
+            Parameters:
+                none
+            Returns:
+                Whether the consumer asked the producer to stop
+        '''
+        return self.load(self.STOP) != 0
+
+    def set_ready(self):
+        '''
+            Tells the consumer that the producer is receiving. Only the producer calls it.
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        self.store(self.READY, 1)
+
+    def ready(self) -> bool:
+        '''
+            Parameters:
+                none
+            Returns:
+                Whether the producer is receiving
+        '''
+        return self.load(self.READY) != 0
+
+    def close(self, unlink: bool = False):
+        '''
+            Detaches from the shared memory block
+            Parameters:
+                unlink: whether to free the block too, only its creator does it
+            Returns:
+                none
+        '''
+        self.buf.release()
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def receive_worker(name: str, expect_src: str):
+    '''
+        The body of the receiver process.
+        Captures and reassembles IP packets with an IPReceiver, verifies the TCP checksum,
+        and pushes the valid TCP segments into the ring.
+        If the ring is full, it waits instead of reading more packets from the socket.
+
+        Parameters:
+            name: the name of the shared memory block of the ring
+            expect_src: the IP of the peer
+        Returns:
+            none
+    '''
+    ring = SharedRing(name=name)
+    receiver = IPReceiver()
+    ring.set_ready()
+    last = time.time()
+    while not ring.stopped():
+        receiver.recv(expect_src, 0.01)
+        while len(receiver.q):
+            segment = receiver.q.popleft()
+            if not receiver.verify_segment(segment, expect_src):
+                ring.count("bad_checksum")
+                continue
+            while not ring.push(segment):
+                ring.count("stalls")
+                if ring.stopped():
+                    return
+                time.sleep(0.0001)
+            ring.count("packets")
+            ring.count("bytes", len(segment))
+        if time.time()-last > 0.5:
+            last = time.time()
+            ring.set_count("kernel_drops", kernel_drops(receiver.sock))
+    ring.set_count("kernel_drops", kernel_drops(receiver.sock))
+    ring.close()
+
+
+class PipelineReceiver():
+    '''
+        A drop-in replacement of IPReceiver for TCP.
+        Capture, filtering, reassembly and checksum verification run in a dedicated process,
+        which hands validated TCP segments over through a SharedRing.
+        The process is started by self.start(), before the SYN is sent, so that no reply is missed
+        while the process opens its socket.
+    '''
+    verifies_tcp = True
+    start_timeout = 5
+
+    def __init__(self, capacity: int = 8 << 20) -> None:
+        '''
+            Parameters:
+                capacity: the size of the ring in bytes
+        '''
+        self.ip = local_ip()
+        self.ring = SharedRing(capacity)
+        self.q = deque()
+        self.process = None
+
+    def start(self, expect_src: str, ports=None):
+        '''
+            Starts the receiver process and waits until its socket is open
+            Parameters:
+                expect_src: the IP of the peer
+                ports: not used, TCP filters the ports
+            Returns:
+                none
+        '''
+        if self.process is not None:
+            return
+        # fork explicitly: forkserver, the default on Linux from Python 3.14, would rerun the __main__
+        # of rawhttpget, which has no main guard, in the helper process
+        self.process = multiprocessing.get_context("fork").Process(
+            target=receive_worker, args=(self.ring.shm.name, expect_src), daemon=True)
+        self.process.start()
+        start = time.time()
+        while not self.ring.ready():
+            if not self.process.is_alive() or time.time()-start > self.start_timeout:
+                print("Receiver process failed to start")
+                exit()
+            time.sleep(0.001)
+
+    def drain(self) -> int:
+        '''
+            Moves every segment in the ring into self.q
+            Parameters:
+                none
+            Returns:
+                The number of moved segments
+        '''
+        n = 0
+        segment = self.ring.pop()
+        while segment is not None:
+            self.q.append(segment)
+            n += 1
+            segment = self.ring.pop()
+        return n
+
+    def recv(self, expect_src: str, timeout):
+        '''
+            Waits at most timeout seconds for segments from the receiver process
+            Parameters:
+                expect_src: as its name
+                timeout: the maximum receiving time
+            Returns:
+                none
+        '''
+        self.start(expect_src)
+        start = time.time()
+        while self.drain() == 0 and time.time()-start < timeout:
+            if not self.process.is_alive():
+                print("Receiver process exited")
+                exit()
+            time.sleep(min(timeout, 0.0001))
+
+    def stats(self) -> dict:
+        '''
+            Parameters:
+                none
+            Returns:
+                The counters of the receiver process
+        '''
+        return self.ring.counters()
+
+    def close(self):
+        '''
+            Stops the receiver process and frees the ring
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        self.ring.stop()
+        if self.process is not None:
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.ring.close(unlink=True)
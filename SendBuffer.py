@@ -1,13 +1,16 @@
 import heapq
 import time
+from collections import deque
 
 
 class SendBuffer():
     '''
         A data structure that keeps data.
-        Has a priority queue and a dict.
+        Has a priority queue, a dict and a deque.
         The dict keeps these unconfirmed data. Data can be confirmed with its key in the dict.
         The priority queue sorts data by the time they are pushed.
+        The deque keeps the keys in the order they are pushed, which is ascending,
+        so a cumulative ACK confirms the keys at its head.
 
         When a data is confirmed, this data structure uses a lazy strategy to remove the related entry:
         Only the entry in the dict is removed immediately within O(1) time,
@@ -17,22 +20,24 @@ class SendBuffer():
 
     def __init__(self) -> None:
         '''
-            Initializes itself with a priority queue and a dict
+            Initializes itself with a priority queue, a dict and a deque
         '''
         self.pq = []
         self.buf = {}
+        self.keys = deque()
 
     def push(self, expect_ack, data):
         '''
             Keeps a price of data and the number used to confirm it.
             Parameters:
-                expect_ack: the number that confirms data
+                expect_ack: the number that confirms data, larger than the ones pushed before
                 data: as its name
             Returns:
                 none
         '''
         heapq.heappush(self.pq, (time.time(), expect_ack))
         self.buf[expect_ack] = data
+        self.keys.append(expect_ack)
 
     def clear(self):
         '''
@@ -57,6 +62,18 @@ class SendBuffer():
             self.buf.pop(ack)
             self.clear()
 
+    def confirm_upto(self, ack):
+        '''
+            Confirms every piece of data whose key is not larger than a cumulative ACK number
+            Parameters:
+                ack: the ACK number
+            Returns:
+                none
+        '''
+        while len(self.keys) and self.keys[0] <= ack:
+            self.buf.pop(self.keys.popleft(), None)
+        self.clear()
+
     def size(self):
         '''
             Parameters:
@@ -81,6 +98,23 @@ class SendBuffer():
         self.clear()
         return ack, data
 
+    def first_after(self, ack):
+        '''
+            Finds the unconfirmed data with the smallest key larger than ack.
+            The keys confirmed one by one are dropped from the head of the deque here,
+            so the answer is at its head once ack has been passed to self.confirm_upto().
+            Parameters:
+                ack: the largest ACK number received
+            Returns:
+                (key, data) if there is any, otherwise none
+        '''
+        while len(self.keys) and self.keys[0] not in self.buf:
+            self.keys.popleft()
+        for key in self.keys:
+            if key > ack and key in self.buf:
+                return key, self.buf[key]
+        return None
+
     def should_send(self):
         '''
             Parameters:
@@ -0,0 +1,298 @@
+import mmap
+import os
+from collections import deque
+
+
+class BytesBody():
+    '''
+        A body kept in memory
+    '''
+
+    def __init__(self, data: bytes) -> None:
+        '''
+            Parameters:
+                data: the body
+        '''
+        self.data = data
+        self.pos = 0
+
+    def __len__(self) -> int:
+        '''
+            Parameters:
+                none
+            Returns:
+                The size of the body in bytes
+        '''
+        return len(self.data)
+
+    def peek(self, n: int) -> bytes:
+        '''
+            Parameters:
+                n: the maximum number of bytes
+            Returns:
+                The next bytes of the body, at most n bytes, without consuming them
+        '''
+        return self.data[self.pos:self.pos+n]
+
+    def advance(self, n: int):
+        '''
+            Consumes n bytes returned by self.peek()
+            Parameters:
+                n: the number of bytes
+            Returns:
+                none
+        '''
+        self.pos += n
+
+    def done(self) -> bool:
+        '''
+            Parameters:
+                none
+            Returns:
+                Whether every byte of the body has been consumed
+        '''
+        return self.pos >= len(self.data)
+
+    def close(self):
+        '''
+            Releases the resources of the body
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        pass
+
+
+class FileBody():
+    '''
+        A body read from a file.
+        The file is mmapped, so segments are sliced from it on demand instead of being loaded into memory.
+    '''
+
+    def __init__(self, path: str) -> None:
+        '''
+            Parameters:
+                path: the path of the file
+        '''
+        self.f = open(path, "rb")
+        self.size = os.fstat(self.f.fileno()).st_size
+        self.map = None
+        if self.size:
+            self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.map.madvise(mmap.MADV_SEQUENTIAL)
+        self.pos = 0
+
+    def __len__(self) -> int:
+        '''
+            Parameters:
+                none
+            Returns:
+                The size of the body in bytes
+        '''
+        return self.size
+
+    def peek(self, n: int) -> bytes:
+        '''
+            Parameters:
+                n: the maximum number of bytes
+            Returns:
+                The next bytes of the file, at most n bytes, sliced from the map without consuming them
+        '''
+        if self.map is None:
+            return b""
+        return self.map[self.pos:self.pos+n]
+
+    def advance(self, n: int):
+        '''
+            Consumes n bytes returned by self.peek()
+            Parameters:
+                n: the number of bytes
+            Returns:
+                none
+        '''
+        self.pos += n
+
+    def done(self) -> bool:
+        '''
+            Parameters:
+                none
+            Returns:
+                Whether every byte of the body has been consumed
+        '''
+        return self.pos >= self.size
+
+    def close(self):
+        '''
+            Unmaps and closes the file
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.f.close()
+
+
+class IterBody():
+    '''
+        A body produced by an iterator of bytes, whose length is unknown in advance.
+        If chunked is True, each piece is framed with the chunked transfer coding of HTTP/1.1.
+        self.size counts the bytes pulled from the iterator so far.
+    '''
+
+    def __init__(self, it, chunked: bool = True) -> None:
+        '''
+            Parameters:
+                it: an iterable of bytes
+                chunked: whether to apply the chunked transfer coding
+        '''
+        self.it = iter(it)
+        self.chunked = chunked
+        self.buf = b""
+        self.pos = 0
+        self.size = 0
+        self.exhausted = False
+
+    def fill(self, n: int):
+        '''
+            Pulls pieces from the iterator until n bytes are buffered or it is exhausted
+            Parameters:
+                n: the number of bytes wanted
+            Returns:
+                none
+        '''
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        while len(self.buf) < n and not self.exhausted:
+            try:
+                piece = next(self.it)
+            except StopIteration:
+                self.exhausted = True
+                if self.chunked:
+                    self.buf += b"0\r\n\r\n"
+                break
+            if len(piece) == 0:
+                continue
+            self.size += len(piece)
+            if self.chunked:
+                piece = f"{len(piece):x}\r\n".encode()+piece+b"\r\n"
+            self.buf += piece
+
+    def peek(self, n: int) -> bytes:
+        '''
+            Parameters:
+                n: the maximum number of bytes
+            Returns:
+                The next bytes of the body, at most n bytes, pulling pieces from the iterator if needed
+        '''
+        if len(self.buf)-self.pos < n:
+            self.fill(n)
+        return self.buf[self.pos:self.pos+n]
+
+    def advance(self, n: int):
+        '''
+            Consumes n bytes returned by self.peek()
+            Parameters:
+                n: the number of bytes
+            Returns:
+                none
+        '''
+        self.pos += n
+
+    def done(self) -> bool:
+        '''
+            Parameters:
+                none
+            Returns:
+                Whether the iterator is exhausted and every buffered byte has been consumed
+        '''
+        if self.pos >= len(self.buf):
+            self.fill(1)
+        return self.pos >= len(self.buf)
+
+    def close(self):
+        '''
+            Nothing to release, the iterator belongs to the caller
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        pass
+
+
+class SendStream():
+    '''
+        The bytes TCP sends, made of several bodies one after another, e.g. an HTTP header and a file.
+        TCP takes them segment by segment with self.peek() and self.advance().
+    '''
+
+    def __init__(self, *bodies) -> None:
+        '''
+            Parameters:
+                bodies: bytes, BytesBody, FileBody or IterBody objects
+        '''
+        self.bodies = deque()
+        for body in bodies:
+            if isinstance(body, (bytes, bytearray)):
+                body = BytesBody(bytes(body))
+            self.bodies.append(body)
+        self.skip()
+
+    def skip(self):
+        '''
+            Drops the finished bodies at the front
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        while len(self.bodies) and self.bodies[0].done():
+            self.bodies.popleft().close()
+
+    def pending(self) -> bool:
+        '''
+            Parameters:
+                none
+            Returns:
+                Whether there are bytes left to send
+        '''
+        return len(self.bodies) > 0
+
+    def peek(self, n: int) -> bytes:
+        '''
+            Parameters:
+                n: the maximum number of bytes
+            Returns:
+                The next bytes to send, at most n bytes and within one body, without consuming them
+        '''
+        if len(self.bodies) == 0:
+            return b""
+        return self.bodies[0].peek(n)
+
+    def advance(self, n: int):
+        '''
+            Consumes n bytes returned by self.peek()
+            Parameters:
+                n: the number of bytes
+            Returns:
+                none
+        '''
+        if n:
+            self.bodies[0].advance(n)
+            self.skip()
+
+    def close(self):
+        '''
+            Releases the bodies that are not finished
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        while len(self.bodies):
+            self.bodies.popleft().close()
@@ -0,0 +1,328 @@
+#! /usr/bin/env python3
+import argparse
+import random
+import sys
+import time
+from collections import deque
+from struct import pack, unpack
+import MyTCP
+from MyIP import IPReceiver, IPSender
+from MyTCP import TCP
+from SendBuffer import SendBuffer
+from SendStream import SendStream
+
+'''
+    Runs TCP against a simulated peer in the same process, without root or network,
+    to check the paths that are hard to trigger on purpose with a real server:
+    small and closing receive windows, losses with each congestion control, and pacing.
+
+    The peer is a minimal server: it ACKs every segment or every few segments, keeps the data within its window,
+    and answers with a short response and FIN once it gets our FIN.
+    The retransmission timeout is shortened, so that tail losses do not take a minute.
+'''
+
+CLIENT, SERVER = "10.0.0.2", "10.0.0.1"
+RESPONSE = b"HTTP/1.1 201 Created\r\nContent-Length: 0\r\n\r\n"
+
+
+class Stalled(Exception):
+    '''
+        Raised when a connection is not closed by its deadline
+    '''
+
+
+class SimPeer():
+    '''
+        The server side of a connection.
+        Segments from TCP arrive through self.receive(), replies go into self.q, which is the queue of the SimReceiver.
+        Its window is the free space of a receive buffer of self.window bytes. The application reads
+        the buffer at once, except for a while after close_after bytes, so that the window fills up and closes.
+        Like a delayed ACK, an in-order segment may be ACKed only with the next ack_every-1 ones,
+        or after ack_delay seconds; other segments are ACKed at once.
+    '''
+    ack_delay = 0.04
+
+    def __init__(self, window: int = 65535, loss: float = 0, close_after: int = None,
+                 closed_for: float = 1, update: bool = True, ack_every: int = 1, seed: int = 0) -> None:
+        '''
+            Parameters:
+                window: the size of the receive buffer
+                loss: the probability that a data segment is dropped
+                close_after: the number of received bytes after which the application stops reading
+                closed_for: how long the application stops reading in seconds
+                update: whether a window update is sent when the application reads again,
+                    otherwise TCP only learns it by probing
+                ack_every: the number of in-order segments confirmed by one ACK
+                seed: the seed of the losses
+        '''
+        self.window = window
+        self.loss = loss
+        self.close_after = close_after
+        self.closed_for = closed_for
+        self.update = update
+        self.ack_every = ack_every
+        self.unacked = 0
+        self.ack_at = None
+        self.random = random.Random(seed)
+        self.q = deque()
+        self.rcv_nxt = None
+        self.snd_nxt = 1000
+        self.ooo = {}
+        self.buffered = 0
+        self.body = bytearray()
+        self.paused_until = None
+        self.fin = False
+
+    def advertised(self) -> int:
+        '''
+            Parameters:
+                none
+            Returns:
+                The current receive window
+        '''
+        return self.window-self.buffered
+
+    def reply(self, flags: int, data: bytes = b""):
+        '''
+            Queues a segment to TCP
+            Parameters:
+                flags: the control bits
+                data: as its name
+            Returns:
+                none
+        '''
+        header = pack("!HHIIBBHHH", self.port, self.client_port, self.snd_nxt % TCP.mod,
+                      self.rcv_nxt % TCP.mod, 5 << 4, flags, self.advertised(), 0, 0)
+        self.q.append(header+data)
+        self.snd_nxt += len(data)
+        self.unacked = 0
+        self.ack_at = None
+
+    def receive(self, segment: bytes):
+        '''
+            Handles a segment from TCP
+            Parameters:
+                segment: the TCP segment
+            Returns:
+                none
+        '''
+        sp, dp, seq, ack, offset, control, window, _, _ = unpack("!HHLLBBHHH", segment[:20])
+        payload = segment[4*(offset >> 4):]
+        if control & 0x02:
+            self.port, self.client_port = dp, sp
+            self.rcv_nxt = seq+1
+            self.reply(0x12)
+            self.snd_nxt += 1
+            return
+        if len(payload) and self.random.random() < self.loss:
+            return
+        seq = TCP.get_raw_number(seq, self.rcv_nxt)
+        in_order = False
+        if len(payload) and seq >= self.rcv_nxt and seq+len(payload) <= self.rcv_nxt+self.advertised():
+            self.ooo[seq] = payload
+            in_order = seq == self.rcv_nxt and len(self.ooo) == 1
+        while self.rcv_nxt in self.ooo:
+            data = self.ooo.pop(self.rcv_nxt)
+            self.body += data
+            self.rcv_nxt += len(data)
+            self.buffered += len(data)
+        if self.close_after is not None and len(self.body) >= self.close_after:
+            self.close_after = None
+            self.paused_until = time.time()+self.closed_for
+        if self.paused_until is None:
+            self.buffered = 0
+        if control & 0x01 and seq+len(payload) == self.rcv_nxt and not self.fin:
+            self.fin = True
+            self.rcv_nxt += 1
+            self.reply(0x18, RESPONSE)
+            self.reply(0x11)
+            self.snd_nxt += 1
+        elif len(payload) or control & 0x01 or seq < self.rcv_nxt:
+            # segments out of the window, such as zero-window probes, are answered with an ACK
+            self.unacked += 1
+            if in_order and self.unacked < self.ack_every:
+                self.ack_at = self.ack_at or time.time()+self.ack_delay
+            else:
+                self.reply(0x10)
+
+    def tick(self):
+        '''
+            Sends a delayed ACK when it is due,
+            and lets the application read again after its pause, telling TCP with a window update
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        if self.ack_at is not None and time.time() >= self.ack_at:
+            self.reply(0x10)
+        if self.paused_until is not None and time.time() >= self.paused_until:
+            self.paused_until = None
+            self.buffered = 0
+            if self.update:
+                self.reply(0x10)
+
+
+class SimLink(IPSender):
+    '''
+        Hands the segments of TCP to a SimPeer
+    '''
+
+    def __init__(self, peer: SimPeer) -> None:
+        '''
+            Parameters:
+                peer: the SimPeer
+        '''
+        self.ip, self.dst = CLIENT, SERVER
+        self.peer = peer
+
+    def send(self, data: bytes):
+        '''
+            Parameters:
+                data: a TCP segment
+            Returns:
+                none
+        '''
+        self.peer.receive(data)
+
+
+class SimReceiver(IPReceiver):
+    '''
+        Gives TCP the segments of a SimPeer, and raises Stalled when the connection takes too long
+    '''
+    verifies_tcp = True
+
+    def __init__(self, peer: SimPeer, deadline: float) -> None:
+        '''
+            Parameters:
+                peer: the SimPeer
+                deadline: the time by which the connection has to be closed
+        '''
+        self.ip = CLIENT
+        self.peer = peer
+        self.q = peer.q
+        self.container = {}
+        self.deadline = deadline
+
+    def recv(self, expect_src: str, timeout):
+        '''
+            Parameters:
+                expect_src: as its name
+                timeout: the maximum waiting time
+            Returns:
+                none
+        '''
+        if time.time() > self.deadline:
+            raise Stalled()
+        self.peer.tick()
+        if len(self.q) == 0:
+            time.sleep(timeout)
+
+    def stats(self) -> dict:
+        '''
+            Parameters:
+                none
+            Returns:
+                No counters, nothing is dropped on the way
+        '''
+        return {}
+
+    def close(self):
+        '''
+            Nothing to release
+            Parameters:
+                none
+            Returns:
+                none
+        '''
+        pass
+
+
+def run(size: int, tcp_args: dict = None, limit: float = 20, **peer_args):
+    '''
+        Uploads size bytes to a SimPeer
+        Parameters:
+            size: the size of the body
+            tcp_args: keyword arguments given to TCP
+            limit: the maximum duration in seconds
+            peer_args: keyword arguments given to SimPeer
+        Returns:
+            A dict of the outcome: whether the body and the response arrived intact, the duration,
+            the statistics of TCP, the final ssthresh of its congestion control,
+            and the largest number of segments its SendBuffer held
+    '''
+    body = random.Random(size).randbytes(size)
+    peer = SimPeer(**peer_args)
+    tcp = TCP(SERVER, 80, receiver=SimReceiver(peer, time.time()+limit),
+              ips=SimLink(peer), **(tcp_args or {}))
+    algorithm, controls = tcp.congestion, []
+
+    def congestion(mss: int):
+        controls.append(algorithm(mss))
+        return controls[-1]
+    tcp.congestion = congestion
+    peak = [0]
+
+    class TrackedBuffer(SendBuffer):
+        def push(self, expect_ack, data):
+            super().push(expect_ack, data)
+            peak[0] = max(peak[0], self.size())
+    MyTCP.SendBuffer = TrackedBuffer
+    start = time.time()
+    try:
+        response = b"".join(tcp.tcp_process(SendStream(body)))
+        ok = bytes(peer.body) == body and response == RESPONSE
+    except Stalled:
+        ok = False
+    finally:
+        MyTCP.SendBuffer = SendBuffer
+    return {"ok": ok, "seconds": time.time()-start, "ssthresh": controls[0].ssthresh,
+            "buffered": peak[0], **tcp.stats}
+
+
+SCENARIOS = {
+    "plain": (lambda: run(300000), None),
+    "window 3000": (lambda: run(300000, window=3000), None),
+    "window 1000": (lambda: run(300000, window=1000), None),
+    "zero window": (lambda: run(300000, close_after=100000, closed_for=2),
+                    lambda r: r["ssthresh"] == 1 << 30),
+    "zero window probe": (lambda: run(300000, close_after=100000, closed_for=1, update=False),
+                          lambda r: r["ssthresh"] == 1 << 30 and r["probes"] > 0 and r["retransmits"] == 0),
+    "delayed ack": (lambda: run(3000000, ack_every=2),
+                    lambda r: r["buffered"] <= 2*65535//1460),
+    "loss newreno": (lambda: run(300000, {"cc": "newreno"}, loss=0.02), None),
+    "loss cubic": (lambda: run(300000, {"cc": "cubic"}, loss=0.02), None),
+    "pacing 1MB/s": (lambda: run(300000, {"pacing_rate": 1 << 20}),
+                     lambda r: r["seconds"] > 300000/(1 << 20)*0.8),
+}
+
+
+def main() -> int:
+    '''
+        Runs the scenarios
+        Returns:
+            The exit status: 1 if a scenario failed, otherwise 0
+    '''
+    parser = argparse.ArgumentParser(description="Runs TCP against a simulated peer")
+    parser.add_argument("names", nargs="*",
+                        help="run only the scenarios whose name contains one of these words")
+    args = parser.parse_args()
+    SendBuffer.delay = 0.5
+    failed = []
+    for name, (scenario, check) in SCENARIOS.items():
+        if args.names and not any(word in name for word in args.names):
+            continue
+        r = scenario()
+        ok = r["ok"] and (check is None or check(r))
+        stats = ", ".join(f"{key}={value}" for key, value in r.items() if key not in ("ok", "seconds"))
+        print(f"{name:<20}{'ok' if ok else 'FAILED':<8}{r['seconds']:>6.2f}s  {stats}")
+        if not ok:
+            failed.append(name)
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,6 @@
+from Profiler import PROFILER
+
+
 def checksum(data: bytes) -> bytes:
     '''
         Calculate the 16-bit checksum of the given bytes
@@ -6,18 +9,19 @@ def checksum(data: bytes) -> bytes:
         Returns:
             The checksum
     '''
-    copy = data
-    if len(copy) % 2:
-        copy += b"\0"
-    ret = 0
-    for i in range(0, len(copy), 2):
-        a = copy[i] << 8
-        a += copy[i+1]
-        ret += a
-        while ret > 0xffff:
-            ret = (ret & 0xffff)+1
-    ret = (~ret) & 0xffff
-    return ret.to_bytes(2, "big")
+    with PROFILER.span("checksum"):
+        copy = data
+        if len(copy) % 2:
+            copy += b"\0"
+        ret = 0
+        for i in range(0, len(copy), 2):
+            a = copy[i] << 8
+            a += copy[i+1]
+            ret += a
+            while ret > 0xffff:
+                ret = (ret & 0xffff)+1
+        ret = (~ret) & 0xffff
+        return ret.to_bytes(2, "big")
 
 
 def verify(data: bytes) -> bool: